@@ -1,19 +1,36 @@
-import csv
+import hashlib
+import heapq
+import threading
 import time
-import requests
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
-from flask_session import Session
-from datetime import datetime
-from collections import defaultdict
-from dateutil import parser
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from operator import attrgetter
 import json
+import os
+import clock
+import metrics
+from route_catalog import route_bullet, route_catalog
+from session_backend import init_session
+from station_geo import get_station_grid
+from station_search import get_station_search
+from stop_index import get_stop_index
+from arrival_history import arrival_history_from_env
+from arrivals_poller import ArrivalsPoller
+from gtfs_realtime import FeedIndex, feed_source_from_env
+from headway_engine import headway_engine
+from journey_planner import get_timetable
+from shared_arrivals import SharedArrivalsReader, shared_arrivals_path
+from stop_snapshot import get_stop_metadata, get_stop_snapshot, get_stop_snapshots, set_snapshot_source
+from topology import TRUNK_LINE_COLORS, get_topology
+from transfer_graph import get_transfer_graph
+from transiter import clean_stop_id
 
 
 app = Flask(__name__, template_folder="templates")
-app.secret_key = 'your-secret-key-here'
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+init_session(app)
+metrics.init_app(app)
 
 # Default settings
 DEFAULT_SETTINGS = {
@@ -23,57 +40,115 @@ DEFAULT_SETTINGS = {
     'font_size': '16'
 }
 
-TRANSITER_BASE_URL = "https://demo.transiter.dev"
-
-def get_line_name(stop_id):
-    route_id = stop_id[0]
-    base_url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/routes/{route_id}"
-
-    try:
-        response = requests.get(base_url)
-        response.raise_for_status()
-        route_data = response.json()
-        train_name = route_data.get("shortName", "Unknown Train")
-        
-        # Special handling for shuttles
-        if train_name == "S":
-            if route_id == "GS":
-                return "42nd Street Shuttle"
-            elif route_id == "FS":
-                return "Franklin Avenue Shuttle"
-            elif route_id == "H":
-                return "Rockaway Shuttle"
-            else:
-                return "Shuttle"
-        return train_name
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching route info for {route_id}: {e}")
+# Route names are static; load them once instead of per train
+try:
+    route_catalog.load_routes_txt('routes.txt')
+except FileNotFoundError:
+    print("routes.txt not found, fetching route catalog from Transiter")
+    route_catalog.refresh_from_transiter()
+
+# Parse stops.txt, trunk_line_stops.json and transfers.txt once at startup;
+# lookups reload them only if the files change. Bad stop ids in the
+# topology fail here.
+get_stop_index('stops.txt')
+get_topology()
+get_transfer_graph()
+get_station_grid('stops.txt')
+get_station_search('stops.txt')
+
+ROUTE_REFRESH_SECONDS = int(os.environ.get('ROUTE_REFRESH_SECONDS', '0'))
+if ROUTE_REFRESH_SECONDS > 0:
+    route_catalog.start_background_refresh(ROUTE_REFRESH_SECONDS)
+
+# Where realtime arrivals come from:
+#   transiter - per-stop Transiter REST calls, polled in the background for
+#               every stop being viewed so all screens on a stop share one
+#               upstream fetch per interval
+#   gtfs-rt   - the MTA GTFS-Realtime feeds decoded in bulk into one
+#               system-wide index (GTFS_RT_FEED_DIR reads recorded .pb files)
+#   shm       - the gtfs-rt index, refreshed by one separate fetcher process
+#               (python shared_arrivals.py) and mapped read-only by every
+#               worker from SHARED_ARRIVALS_PATH
+ARRIVALS_BACKEND = os.environ.get('ARRIVALS_BACKEND', 'transiter')
+ARRIVALS_POLL_SECONDS = int(os.environ.get('ARRIVALS_POLL_SECONDS', '15'))
+if ARRIVALS_BACKEND == 'gtfs-rt':
+    feed_index = FeedIndex(feed_source_from_env(), interval=int(os.environ.get('GTFS_RT_REFRESH_SECONDS', '30')))
+    feed_index.start()
+    set_snapshot_source(feed_index.get_snapshots)
+    arrivals_source = feed_index
+elif ARRIVALS_BACKEND == 'shm':
+    shared_arrivals = SharedArrivalsReader(shared_arrivals_path())
+    shared_arrivals.start()
+    set_snapshot_source(shared_arrivals.get_snapshots)
+    arrivals_source = shared_arrivals
+else:
+    arrivals_poller = ArrivalsPoller(interval=ARRIVALS_POLL_SECONDS)
+    set_snapshot_source(arrivals_poller.get_many)
+    arrivals_poller.start()
+    arrivals_source = arrivals_poller
+# Observed headways come from watching trains leave in successive snapshots
+arrivals_source.listeners.append(headway_engine.observe_snapshots)
+
+# Every stored platform snapshot is also appended to the on-disk history;
+# under shm the fetcher process writes it and workers only query it
+arrival_history = arrival_history_from_env()
+if arrival_history is not None and ARRIVALS_BACKEND != 'shm':
+    arrival_history.start()
+    arrivals_source.listeners.append(arrival_history.record_snapshots)
+
+# Open /stream connections wake on every arrivals update, and at least this
+# often so minute counts tick down and proxies see traffic
+STREAM_HEARTBEAT_SECONDS = int(os.environ.get('STREAM_HEARTBEAT_SECONDS', '15'))
+# Each open stream holds a worker thread, so streams end after
+# STREAM_MAX_SECONDS (browsers reconnect after STREAM_RETRY_MS) and each
+# process serves at most STREAM_MAX_CONNECTIONS at once; past that /stream
+# answers 503 and the board falls back to reloading. Run with a threaded
+# or async worker class (e.g. gunicorn -k gthread) and size its threads
+# above STREAM_MAX_CONNECTIONS so pages still get served.
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', '300'))
+STREAM_RETRY_MS = int(os.environ.get('STREAM_RETRY_MS', '3000'))
+STREAM_MAX_CONNECTIONS = int(os.environ.get('STREAM_MAX_CONNECTIONS', '16'))
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+
+def get_line_name(route_id):
+    """Resolve a route id to its display name from the in-memory route catalog."""
+    train_name = route_catalog.short_name(route_id)
+    if train_name is None:
+        # Fall back to the bare service letter, e.g. "6X" -> "6"
+        train_name = route_catalog.short_name(route_id[:1])
+    if train_name is None:
         return "Unknown Train"
 
+    # Special handling for shuttles
+    if train_name == "S":
+        if route_id == "GS":
+            return "42nd Street Shuttle"
+        elif route_id == "FS":
+            return "Franklin Avenue Shuttle"
+        elif route_id == "H":
+            return "Rockaway Shuttle"
+        else:
+            return "Shuttle"
+    return train_name
+
 def parse_stops(file_path, specific_line_stops=None):
     lines_stations = {}
     
-    with open(file_path, newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            stop_id = row["stop_id"]
-            stop_name = row["stop_name"]
-            
-            # Skip if it's a child station (ends with N or S)
-            if stop_id[-1] in ['N', 'S']:
-                continue
-            
-            # If specific stops are provided, only include those
-            if specific_line_stops:
-                for line, stops in specific_line_stops.items():
-                    if stop_id in stops:
-                        if stop_id not in lines_stations:
-                            lines_stations[stop_id] = {
-                                "stop_id": stop_id,
-                                "stop_name": stop_name,
-                                "stop_lat": float(row["stop_lat"]),
-                                "stop_lon": float(row["stop_lon"])
-                            }
+    # If specific stops are provided, only include those
+    if specific_line_stops:
+        stop_index = get_stop_index(file_path)
+        for line, stops in specific_line_stops.items():
+            for stop_id in stops:
+                stop = stop_index.get(stop_id)
+                # Skip child stations and anything not in stops.txt
+                if stop is None or stop.parent_station or stop_id in lines_stations:
+                    continue
+                lines_stations[stop_id] = {
+                    "stop_id": stop_id,
+                    "stop_name": stop.stop_name,
+                    "stop_lat": stop.stop_lat,
+                    "stop_lon": stop.stop_lon
+                }
             
     return lines_stations
 
@@ -84,364 +159,144 @@ def get_upcoming_trains_for_stop(stop_id, lines_stations):
     if stop_id[-1] not in ['N', 'S']:
         stop_ids.extend([f"{stop_id}N", f"{stop_id}S"])
     
+    snapshots = get_stop_snapshots(stop_ids)
+
+    # Each snapshot's stop_times are already sorted, so merging them lazily
+    # yields the soonest departures first and we can stop after four
+    now = clock.now()
+    upcoming = [snapshot.upcoming(now - 0.5)  # Allow slightly past trains
+                for snapshot in snapshots.values() if snapshot is not None]
+
     all_train_info = []
     seen_trains = set()
-    
-    for current_stop_id in stop_ids:
-        url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{current_stop_id}"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-        except Exception as e:
-            print(f"Error fetching data for stop {current_stop_id}: {e}")
+    for stop_time in heapq.merge(*upcoming, key=attrgetter('departure_time')):
+        route_name = get_line_name(stop_time.route_id)
+        destination = stop_time.destination
+        headsign = stop_time.headsign
+
+        # Only skip if we really have no useful information
+        if destination == "Unknown" and headsign == "Unknown":
+            continue
+        if route_name == "Unknown Line":
             continue
 
-        now = time.time()
-        upcoming_trains = [stop_time for stop_time in data.get("stopTimes", []) 
-                         if float(stop_time["departure"].get("time", 0)) > (now - 0.5)]  # Allow slightly past trains and show more per direction
-
-        for stop_time in upcoming_trains:
-            departure_time = stop_time.get("departure", {}).get("time", None)
-
-            if departure_time is None:
-                continue
-
-            seconds_to_leave = float(departure_time) - now
-            minutes = int(seconds_to_leave / 60)
-
-            trip_info = stop_time.get("trip", {})
-            route_id = trip_info.get("route", {}).get("id", "Unknown")
-            route_name = get_line_name(route_id)
-            destination = trip_info.get("destination", {}).get("name", "Unknown")
-            headsign = stop_time.get("headsign", "Unknown")
-            trip_id = trip_info.get("id", "Unknown")
-
-            # Only skip if we really have no useful information
-            if destination == "Unknown" and headsign == "Unknown":
-                continue
-            if route_name == "Unknown Line":
-                continue
-
-            train_key = f"{route_name}-{destination}-{departure_time}"
-            if train_key not in seen_trains:
-                seen_trains.add(train_key)
-                train_info = {
-                    "route_name": route_name,
-                    "destination": destination or headsign,
-                    "headsign": headsign,
-                    "departure_in_minutes": max(0, minutes)
-                }
-                all_train_info.append(train_info)
-    
-    # Sort by departure time and show more trains
-    return sorted(all_train_info, key=lambda x: x["departure_in_minutes"])[:4]
+        train_key = (route_name, destination, stop_time.departure_time)
+        if train_key in seen_trains:
+            continue
+        seen_trains.add(train_key)
+
+        minutes = int((stop_time.departure_time - now) / 60)
+        all_train_info.append({
+            "route_name": route_name,
+            "route_icon": route_bullet(stop_time.route_id),
+            "destination": destination or headsign,
+            "headsign": headsign,
+            "departure_in_minutes": max(0, minutes),
+            "trip_id": stop_time.trip_id
+        })
+        if len(all_train_info) == 4:
+            break
+
+    return all_train_info
 
 def get_stop_name(stop_id):
-    url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{stop_id}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        return data["name"]
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching station name for {stop_id}: {e}")
+    snapshot = get_stop_metadata(stop_id)
+    if snapshot is None:
         return "Unknown Station"
+    return snapshot.name
 
 def get_transfers_for_stop(stop_id):
-    # Clean the stop_id by removing any /realtime suffix
-    if '/realtime' in stop_id:
-        stop_id = stop_id.replace('/realtime', '')
-    
-    url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{stop_id}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-
-        transfers = data.get('transfers', [])
-        processed_transfers = []
-        for transfer in transfers:
-            from_route = transfer['fromStop']['id'][0]
-            to_route = transfer['toStop']['id'][0]
-            
-            # Handle special cases for shuttles
-            if from_route in ['H', 'S', 'FS']:
-                if from_route == 'H':
-                    from_route = 'h'  # Rockaway
-                elif from_route == 'FS':
-                    from_route = 'fs'  # Franklin
-                else:
-                    from_route = 's'  # 42nd St
-                    
-            if to_route in ['H', 'S', 'FS']:
-                if to_route == 'H':
-                    to_route = 'h'  # Rockaway
-                elif to_route == 'FS':
-                    to_route = 'fs'  # Franklin
-                else:
-                    to_route = 's'  # 42nd St
-            
-            # Clean the stop IDs by removing any /realtime suffix
-            from_stop_id = transfer['fromStop']['id']
-            to_stop_id = transfer['toStop']['id']
-            if '/realtime' in from_stop_id:
-                from_stop_id = from_stop_id.replace('/realtime', '')
-            if '/realtime' in to_stop_id:
-                to_stop_id = to_stop_id.replace('/realtime', '')
-            
-            transfer_info = {
-                'from_stop': transfer['fromStop']['name'],
-                'to_stop': transfer['toStop']['name'],
-                'from_route': from_route.lower(),
-                'to_route': to_route.lower(),
-                'from_stop_id': from_stop_id,
-                'to_stop_id': to_stop_id
-            }
-            processed_transfers.append(transfer_info)
-        return processed_transfers
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching transfers for {stop_id}: {e}")
-        return []
+    """Transfers from the bundled transfers.txt; no upstream call."""
+    return get_transfer_graph().transfers_for(clean_stop_id(stop_id))
 
 def get_route_for_stop(stop_id):
-    url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{stop_id}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        route_id = data.get("route", {}).get("id", "Unknown")
-        return get_line_name(route_id)
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching route for {stop_id}: {e}")
+    snapshot = get_stop_metadata(stop_id)
+    if snapshot is None:
         return "Unknown Route"
+    return get_line_name(snapshot.route_id)
 
 def get_headways_for_stop(stop_id):
-    # Clean the stop_id by removing any /realtime suffix if present
-    if '/realtime' in stop_id:
-        stop_id = stop_id.replace('/realtime', '')
-        
-    url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{stop_id}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        headways = []
-        if 'data' in data:
-            for route in data['data']:
-                route_id = route['route']['id']
-                if 'headways' in route:
-                    headway_info = {
-                        'route_id': route_id,
-                        'scheduled': route['headways'].get('scheduled'),
-                        'observed': route['headways'].get('observed')
-                    }
-                    headways.append(headway_info)
-        return headways
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching headways for {stop_id}: {e}")
-        return []
+    """Transiter's headways per route, plus our own observed stats per route and direction."""
+    snapshot = get_stop_snapshot(stop_id)
+    headways = list(snapshot.headways) if snapshot is not None else []
+    scheduled = {headway['route_id']: headway.get('scheduled') for headway in headways}
+    for stats in headway_engine.stats_for_station(clean_stop_id(stop_id)):
+        stats['scheduled'] = scheduled.get(stats['route_id'])
+        stats['observed'] = stats['mean']
+        headways.append(stats)
+    return headways
+
+# Trunk mapping derived from the stop index, rebuilt when stops.txt changes
+_trunk_mapping_cache = {}
 
 def map_stops_to_trunk_lines():
-    # Define trunk lines and their associated services
-    trunk_lines = {
-        'Eighth Avenue Line': ['A', 'C', 'E'],
-        'Sixth Avenue Line': ['B', 'D', 'F', 'M'],
-        'Crosstown Line': ['G'],
-        'Canarsie Line': ['L'],
-        'Nassau Street Line': ['J', 'Z'],
-        'Broadway Line': ['N', 'Q', 'R', 'W'],
-        'Broadway–Seventh Avenue Line': ['1', '2', '3'],
-        'Lexington Avenue Line': ['4', '5', '6'],
-        'Flushing Line': ['7'],
-        'Second Avenue Line': ['T'],
-        '42nd Street Shuttle': ['GS'],
-        'Franklin Avenue Shuttle': ['FS'],
-        'Rockaway Park Shuttle': ['H'],
-        'Staten Island Railway': ['SIR'],
-    }
-    
-    # Define trunk line colors
-    trunk_line_colors = {
-        'Eighth Avenue Line': '#0039e6',      # Blue
-        'Sixth Avenue Line': '#ff6319',       # Orange
-        'Crosstown Line': '#6cbe45',          # Lime
-        'Canarsie Line': '#a7a9ac',          # Light slate gray
-        'Nassau Street Line': '#996633',      # Brown
-        'Broadway Line': '#fccc0a',           # Yellow
-        'Broadway–Seventh Avenue Line': '#ee352e',  # Red
-        'Lexington Avenue Line': '#00933c',   # Green
-        'Flushing Line': '#b933ad',          # Purple
-        'Second Avenue Line': '#00add0',      # Turquoise
-        '42nd Street Shuttle': '#808183',     # Dark slate gray
-        'Franklin Avenue Shuttle': '#808183', # Dark slate gray
-        'Rockaway Park Shuttle': '#808183',   # Dark slate gray
-        'Shuttles': '#808183',                # Dark slate gray
-        'Staten Island Railway': '##0078C6', 
-    }
-    
-    # Create reverse mapping from service to trunk line
-    service_to_trunk = {}
-    for trunk, services in trunk_lines.items():
-        for service in services:
-            service_to_trunk[service] = trunk
+    service_to_trunk = get_topology().service_to_trunk
+    trunk_line_colors = TRUNK_LINE_COLORS
     
+    stop_index = get_stop_index('stops.txt')
+    if _trunk_mapping_cache.get('version') == stop_index.version:
+        stop_to_trunk, trunk_to_stops = _trunk_mapping_cache['mapping']
+        return stop_to_trunk, trunk_to_stops, trunk_line_colors
+
     stop_to_trunk = {}
     trunk_to_stops = {}
     
-    with open('stops.txt', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            stop_id = row['stop_id']
-            stop_name = row['stop_name']
-            location_type = row.get('location_type', '')
-            
-            # Skip if it's a child station (ends with N or S)
-            if stop_id[-1] in ['N', 'S']:
-                continue
-                
-            # Get the service letter/number from stop_id
-            service = stop_id[0]
-            
-            # If this service belongs to a trunk line
-            if service in service_to_trunk:
-                trunk = service_to_trunk[service]
-                stop_to_trunk[stop_id] = trunk
-                
-                # Initialize trunk_to_stops[trunk] if not exists
-                if trunk not in trunk_to_stops:
-                    trunk_to_stops[trunk] = []
-                    
-                # Add stop info to trunk_to_stops
-                trunk_to_stops[trunk].append({
-                    'stop_id': stop_id,
-                    'stop_name': stop_name,
-                    'service': service
-                })
+    for service, stop_ids in stop_index.stops_by_service.items():
+        # If this service belongs to a trunk line
+        if service not in service_to_trunk:
+            continue
+        trunk = service_to_trunk[service]
+        trunk_stops = trunk_to_stops.setdefault(trunk, [])
+        for stop_id in stop_ids:
+            stop_to_trunk[stop_id] = trunk
+            trunk_stops.append({
+                'stop_id': stop_id,
+                'stop_name': stop_index.stops[stop_id].stop_name,
+                'service': service
+            })
     
+    _trunk_mapping_cache['version'] = stop_index.version
+    _trunk_mapping_cache['mapping'] = (stop_to_trunk, trunk_to_stops)
     return stop_to_trunk, trunk_to_stops, trunk_line_colors
 
-# def get_stops_for_trunk_line(trunk_line, service):
-#     """Map trunk lines and services to their specific stop IDs."""
-#     trunk_line_stops = {
-#         # Done
-#         'Eighth Avenue Line': {
-#             'A': ["A02", "A03", "A05", "A06", "A07", "A09", "A10", "A11", "A12", "A14", "A15", "A16", "A17", "A18", "A19", "A20", "A21", "A22", "A24", "A25", "A27", "A28", "A30", "A31", "A32", "A33", "A34", "A36", "A38", "A40", "A41", "A42", "A43", "A44", "A45", "A46", "A47", "A48", "A49", "A50", "A51", "A52", "A53", "A54", "A55", "A57", "A59", "A60", "A61", "A63", "A64", "A65", "H01", "H02", "H03", "H04", "H06", "H07", "H08", "H09", "H10", "H11", "H12"],
-#             'C': ['A09', "A10", "A11", "A12", "A14", "A15", "A16", "A17", "A18", "A19", "A20", "A21", "A22", "A24", "A25", "A27", "A28", "A30", "A31", "A32", "A33", "A34", "A36", "A38", "A40", "A41", "A42", "A43", "A44", "A45", "A46", "A47", "A48", "A49", "A50", "A51", "A52", "A53", "A54", "A55", "A57", "A59", "A60", "A61", "A63", "A64", "A65", "H01", "H02", "H03", "H04", "H06", "H07", "H08", "H09", "H10", "H11", "H12"],
-#             'E': ["G05", "G06", "G07", "F05", "F06", "F07", "G08", "G09", "G10", "G11", "G12", "G13", "G14", "G15", "G16", "G18", "G19", "G20", "G21", "F09", "F11", "F12", "D14", "A25", "A27", "A28", "A30", "A31", "A32", "A33", "A34", "E01",]
-#         },
-#         # Done 
-#         'Sixth Avenue Line': {
-#             'B': ["D03", "D04", "D05", "D06", "D07", "D08", "D09", "D10", "D11", "D12", "D13", "A14", "A15", "A16", "A17", "A18", "A19", "A20", "A21", "A22", "A24", "D14", "D15", "D16", "D17", "D20", "D21", "D22", "R30", "D24", "D25", "D26", "D27", "D28", "D29", "D30", "D31", "D32", "D33", "D34", "D35", "D39", "D40",],
-#             'D': ['D01', "D03", "D04", "D05", "D06", "D07", "D08", "D09", "D10", "D11", "D12", "D13", "A15", "A24", "D14", "D15", "D16", "D17", "D20", "D21", "D22", "R30", "R31", "R32", "R33", "R34", "R35", "R36", "B12", "B13", "B14", "B15", "B16", "B17", "B18", "B19", "B20", "B21", "B22", "B23", "D43"],
-#             'F': ['F01', 'F02', 'F03', "F04", "F05", "F06", "F07", "G08", "G09", "G10", "G11", "G12", "G13", "G14", "G15", "G16", "G18", "G19", "G20", "B04", "B06", "B08", "B10", "D15", "D16", "D17", "D18", "D19", "D20", "D21", "D22", "F14", "F15", "F16", "F18", "A41", "F20", "F21", "F22", "F23", "F24", "F25", "F26", "F27", "F29", "F30", "F31", "F32", "F33", "F34", "F35", "F36", "F38", 'F39', "D42", "D43",  ],
-#             'M': ["G08", "G09", "G10", "G11", "G12", "G13", "G14", "G15", "G16", "G18", "G19", "G20", "G21", "F09", "F11", "F12", "D15", "D16", "D17", "D18", "D19", "D20", "D21", "M18", "M16", "M14", "M13", "M12", "M11", "M10", "M09", "M08", "M06", "M05", "M04", "M01"]
-#         },
-#         # Done 
-#         'Crosstown Line': {
-#             'G': ["G22", "G24", "G26", "G28", "G29", "G30", "G31", "G32", "G33", "G34", "G35", "G36", "A42", "F20", "F21", "F22", "F23", "F24", "F25", "F26", "F27", "F28"]
-#         },
-#         # Done
-#         'Canarsie Line': {
-#             'L': ["L01", "L02", "L03", "L05", "L06", "L08", "L10", "L11", "L12", "L13", "L14", "L15", "L16", "L17", "L19", "L20", "L21", "L22", "L24", "L25", "L26", "L27", "L28", "L29", "L30"]
-#         },
-#         # Done
-#         'Nassau Street Line': {
-#             'J': ["G05", "G06", "J12", "J13", "J14", "J15", "J16", "J17", "J19", "J20", "J21", "J22", "J23", "J24", "J27", "J28", "J29", "J30", "J31", "M11", "M12", "M14", "M16", "M18", "M19", "M20", "M21", "M22", "M23"],
-#             'Z': ["G05", "G06", "J12", "J13", "J14", "J15", "J16", "J17", "J19", "J20", "J21", "J23", "J24", "J27", "J28", "J30", "M11", "M12", "M13", "M14", "M16", "M18", "M19", "M20", "M21", "M22", "M23"]
-#         },
-#         'Broadway Line': {
-#             'N': ['N01', 'N02', 'N03'],
-#             'Q': ['Q01', 'Q02', 'Q03'],
-#             'R': ['R01', 'R02', 'R03'],
-#             'W': ['W01', 'W02', 'W03']
-#         },
-#         'Broadway–Seventh Avenue Line': {
-#             '1': ['101', '127', '103'],
-#             '2': ['201', '204', '247'],
-#             '3': ['301', '302', '303']
-#         },
-#         'Lexington Avenue Line': {
-#             '4': ['401', '402', '403'],
-#             '5': ['501', '502', '247'],
-#             '6': ['601', '602', '603']
-#         },
-#         # Done  
-#         'Flushing Line': {
-#             '7': ['701', '702', '705', "706", "707", "708", "709", "710", "711", "712", "713", "714", "715", "716", "718", "719", "720", "721", "723", "724", "725", "726", ""]
-#         },
-#         # Done
-#         '42nd Street Shuttle': {
-#             'GS': ['901', '902']
-#         },
-#         # Done
-#         'Franklin Avenue Shuttle': {
-#             'FS': ['D26', 'S01', 'S03', 'S04']
-#         },
-#         # Done
-#         'Rockaway Park Shuttle': {
-#             'H': ['H01', 'H02', 'H03', 'H04', 'H06', 'H07', 'H08', 'H09', 'H10', 'H11', 'H12', 'H13', 'H14', 'H15']
-#         },
-#         # Done
-#         'Staten Island Railway': {
-#             'SIR': ['S09', 'S11', 'S13', 'S14', 'S15', 'S16', 'S17', 'S18', 'S19', 'S20', 'S21', 'S22', 'S23', 'S24', 'S25', 'S26', 'S27', 'S28', 'S29', 'S30', 'S31']
-#         }
-#     }
-#     return trunk_line_stops.get(trunk_line, {}).get(service, [])
-def get_stops_for_trunk_line(trunk_line, service, file_path='trunk_line_stops.json'):
+def get_stops_for_trunk_line(trunk_line, service):
     """Map trunk lines and services to their specific stop IDs."""
-    try:
-        # Load data from JSON file
-        with open(file_path, 'r') as f:
-            trunk_line_stops = json.load(f)
-        
-        # Get the stops for the given trunk line and service
-        return trunk_line_stops.get(trunk_line, {}).get(service, [])
-    
-    except FileNotFoundError:
-        print(f"Error: The file {file_path} was not found.")
-        return []
-    except json.JSONDecodeError:
-        print("Error: Failed to decode JSON.")
-        return []
+    return get_topology().stops_for_service(trunk_line, service)
 
 def get_stop_info(stop_id):
     """Get stop name from stops.txt"""
-    with open('stops.txt', 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row['stop_id'] == stop_id:
-                return {
-                    'stop_id': stop_id,
-                    'stop_name': row['stop_name']
-                }
-    return None
+    stop = get_stop_index('stops.txt').get(stop_id)
+    if stop is None:
+        return None
+    return {
+        'stop_id': stop_id,
+        'stop_name': stop.stop_name
+    }
 
-def get_train_info(stop_id):
-    """Fetch and display train information for a specific stop."""
-    url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{stop_id}/trains"
-    response = requests.get(url)
-    data = response.json()
-    
-    now = time.time()
-    upcoming_trains = [stop_time for stop_time in data.get("stopTimes", []) 
-                       if float(stop_time["departure"].get("time", 0)) > (now - 0.5)]  # Allow slightly past trains
+def get_train_info(stop_id, routes=None):
+    """Fetch and display train information for a specific stop.
 
+    If routes is given, only trains on those route ids are listed.
+    """
+    snapshot = get_stop_snapshot(stop_id)
+    if snapshot is None:
+        return []
+    
+    now = clock.now()
+    upcoming = snapshot.upcoming(now - 0.5)  # Allow slightly past trains
+    if routes:
+        upcoming = [stop_time for stop_time in upcoming if stop_time.route_id in routes]
     all_train_info = []
-    for stop_time in upcoming_trains:
-        departure_time = stop_time.get("departure", {}).get("time", None)
-        if departure_time:
-            departure_in_minutes = (departure_time - now) / 60
-            train_info = {
-                "line": stop_time.get("line", {}).get("id", ""),
-                "destination": stop_time.get("destination", {}).get("name", ""),
-                "departure_in_minutes": int(departure_in_minutes)
-            }
-            all_train_info.append(train_info)
+    for stop_time in upcoming[:4]:
+        departure_in_minutes = (stop_time.departure_time - now) / 60
+        train_info = {
+            "line": stop_time.route_id,
+            "destination": stop_time.destination,
+            "departure_in_minutes": int(departure_in_minutes)
+        }
+        all_train_info.append(train_info)
     
-    # Sort by departure time and show all trains
-    return sorted(all_train_info, key=lambda x: x["departure_in_minutes"])[:4]
+    return all_train_info
 
 @app.route('/')
 def index():
@@ -449,46 +304,20 @@ def index():
     settings = session.get('settings', DEFAULT_SETTINGS)
     return render_template('index.html', services=valid_lines, settings=settings)
 
-@app.route('/service/<service>')
-def service(service):
-    trunk_lines = {
-        'Eighth Avenue Line': ['A', 'C', 'E'],
-        'Sixth Avenue Line': ['B', 'D', 'F', 'M'],
-        'Crosstown Line': ['G'],
-        'Canarsie Line': ['L'],
-        'Nassau Street Line': ['J', 'Z'],
-        'Broadway Line': ['N', 'Q', 'R', 'W'],
-        'Broadway–Seventh Avenue Line': ['1', '2', '3'],
-        'Lexington Avenue Line': ['4', '5', '6'],
-        'Flushing Line': ['7'],
-        'Second Avenue Line': ['T'],
-        '42nd Street Shuttle': ['GS'],
-        'Franklin Avenue Shuttle': ['FS'],
-        'Rockaway Park Shuttle': ['H'],
-        'Staten Island Railway': ['SIR']
-    }
-    
-    trunk_line_colors = {
-        'Eighth Avenue Line': '#0039a6',
-        'Sixth Avenue Line': '#ff6319',
-        'Crosstown Line': '#6cbe45',
-        'Canarsie Line': '#a7a9ac',
-        'Nassau Street Line': '#996633',
-        'Broadway Line': '#fccc0a',
-        'Broadway–Seventh Avenue Line': '#ee352e',
-        'Lexington Avenue Line': '#00933c',
-        'Flushing Line': '#b933ad',
-        'Second Avenue Line': '#00add0'
-    }
+# Rendered /service pages by (service, settings hash). Entries are only
+# valid for the topology version they were rendered from.
+SERVICE_PAGE_CACHE_SIZE = int(os.environ.get('SERVICE_PAGE_CACHE_SIZE', '256'))
+_service_page_cache = {}
+_service_page_lock = threading.Lock()
+
+def render_service_page(service):
+    """Render the /service page, or None for an unknown service."""
+    trunk_line_colors = TRUNK_LINE_COLORS
     
-    current_trunk = None
-    for trunk, services in trunk_lines.items():
-        if service in services:
-            current_trunk = trunk
-            break
+    current_trunk = get_topology().trunk_for_service(service)
             
     if current_trunk is None:
-        return "Invalid line"
+        return None
         
     # Get stops for special trunk lines (shuttles and SIR)
     stops = get_stops_for_trunk_line(current_trunk, service)
@@ -525,14 +354,48 @@ def service(service):
                          settings=settings,
                          trunk_color=trunk_line_colors.get(current_trunk, '#ffffff'))
 
+@app.route('/service/<service>')
+def service(service):
+    topology = get_topology()
+    settings = session.get('settings', DEFAULT_SETTINGS)
+    settings_hash = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    etag = hashlib.sha1(f"{service}|{topology.version}|{settings_hash}".encode()).hexdigest()
+
+    # The page is fully determined by the key, so a matching ETag needs no render
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        with _service_page_lock:
+            # A topology reload drops every page rendered from the old data
+            if _service_page_cache.get('version') != topology.version:
+                _service_page_cache['version'] = topology.version
+                _service_page_cache['pages'] = {}
+            pages = _service_page_cache['pages']
+            html = pages.get((service, settings_hash))
+        if html is None:
+            html = render_service_page(service)
+            if html is None:
+                return "Invalid line"
+            with _service_page_lock:
+                if len(pages) >= SERVICE_PAGE_CACHE_SIZE:
+                    pages.pop(next(iter(pages)))
+                pages[(service, settings_hash)] = html
+        response = app.response_class(html, mimetype='text/html')
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/traininfo/<stop_id>')
 def train_info(stop_id):
+    # Fetches the stop and its N/S platforms together; the name comes from the same snapshot
+    lines_stations = parse_stops('stops.txt')
+    train_info = get_upcoming_trains_for_stop(stop_id, lines_stations)
+
     stop_name = get_stop_name(stop_id)
     if not stop_name:
         return "Stop not found", 404
 
-    lines_stations = parse_stops('stops.txt')
-    train_info = get_upcoming_trains_for_stop(stop_id, lines_stations)
     transfers = get_transfers_for_stop(stop_id)
     
     # Get trunk line info for this stop
@@ -550,6 +413,7 @@ def train_info(stop_id):
     })
 
     return render_template('traininfo.html', 
+                         stop_id=stop_id,
                          stop_name=stop_name,
                          train_info=train_info,
                          transfers=transfers,
@@ -557,6 +421,57 @@ def train_info(stop_id):
                          trunk_line_colors=trunk_line_colors,
                          settings=settings)
 
+def arrival_row_id(train):
+    """Stable id for an arrival row, so a stream can update it in place."""
+    if train['trip_id'] != "Unknown":
+        return train['trip_id']
+    return f"{train['route_name']}|{train['destination']}"
+
+@app.route('/stream/<stop_id>')
+def stream_arrivals(stop_id):
+    """Server-sent events with the arrival rows of a stop that changed.
+
+    Every open stream reads the shared arrivals source, so viewers cost no
+    upstream calls. Each event is JSON {"upserts": [...], "removes": [...],
+    "order": [...]}, with rows keyed by "id"; the first event carries every
+    row and "reset": true. Streams close after STREAM_MAX_SECONDS and the
+    browser reconnects.
+    """
+    stop_id = clean_stop_id(stop_id)
+    if not _stream_slots.acquire(blocking=False):
+        return Response("Too many open streams\n", status=503, mimetype='text/plain',
+                        headers={'Retry-After': str(STREAM_MAX_SECONDS)})
+
+    def events():
+        rows = None
+        version = None
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            version = arrivals_source.wait_for_update(version, timeout=STREAM_HEARTBEAT_SECONDS)
+            current = {}
+            for train in get_upcoming_trains_for_stop(stop_id, None):
+                train['id'] = arrival_row_id(train)
+                current[train['id']] = train
+
+            previous = rows or {}
+            upserts = [train for row_id, train in current.items() if previous.get(row_id) != train]
+            removes = [row_id for row_id in previous if row_id not in current]
+            if upserts or removes or rows is None:
+                changes = {'upserts': upserts, 'removes': removes, 'order': list(current)}
+                if rows is None:
+                    changes['reset'] = True
+                yield f"data: {json.dumps(changes)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            rows = current
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the client left first
+    response.call_on_close(_stream_slots.release)
+    return response
+
 @app.route('/get_stops/<service>', methods=['GET'])
 def get_stops(service):
     lines_stations = parse_stops(r"stops.txt")
@@ -565,17 +480,18 @@ def get_stops(service):
 
 @app.route('/search', methods=['POST'])
 def search():
-    parent_station = request.form['parent_station']
+    parent_station = request.form['parent_station'].strip()
+    # Accept a station name as well as an id: use the best search match
+    if parent_station not in get_stop_index('stops.txt'):
+        matches = get_station_search('stops.txt').search(parent_station, limit=1)
+        if matches:
+            parent_station = matches[0]['stop_id']
     lines_stations = parse_stops(r"stops.txt")
     
     train_info = get_upcoming_trains_for_stop(parent_station, lines_stations)
     transfers = get_transfers_for_stop(parent_station)
 
-    lines_info = set()
-    for line, stations in lines_stations.items():
-        for station in stations:
-            if station["stop_id"] == parent_station:
-                lines_info.add(line)
+    lines_info = set(get_topology().routes_for_stop(parent_station))
 
     stop_name = get_stop_name(parent_station)
 
@@ -587,9 +503,20 @@ def search():
                          transfers=transfers,
                          settings=settings)
 
-@app.route('/get_train_info', methods=['GET'])
-def get_train_info():
-    stop_id = request.args.get('stop_id')
+@app.route('/search_stations', methods=['GET'])
+def search_stations():
+    """Autocomplete: stations matching ?q= (prefix, then typo-tolerant), with their routes."""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({'results': get_station_search('stops.txt').search(query, limit)})
+
+# Registered under the old endpoint name; the view function itself is named
+# so that it no longer shadows the get_train_info() helper above.
+@app.route('/get_train_info', methods=['GET'], endpoint='get_train_info')
+def get_train_info_json():
+    stop_id = request.args.get('stop_id', '').strip()
+    if not stop_id:
+        return jsonify({'error': 'stop_id is required'}), 400
     lines_stations = parse_stops(r"stops.txt")
     
     train_info = get_train_info(stop_id)
@@ -602,6 +529,220 @@ def get_train_info():
         'transfers': transfers
     })
 
+# Upper bound on stops per batch request, so one call can't fan out unbounded
+MAX_BATCH_STOPS = int(os.environ.get('MAX_BATCH_STOPS', '50'))
+
+def split_ids(values):
+    """Flatten repeated and comma-separated id parameters, dropping blanks and duplicates."""
+    ids = []
+    for value in values:
+        ids.extend(part.strip() for part in str(value).split(','))
+    return list(dict.fromkeys(part for part in ids if part))
+
+@app.route('/get_train_info_batch', methods=['GET', 'POST'])
+def get_train_info_batch():
+    """/get_train_info for several stops in one request.
+
+    GET takes stop_id (repeated or comma-separated) and optional route
+    parameters; POST takes JSON {"stop_ids": [...], "routes": [...]}.
+    All stops are fetched together, so shared and concurrent upstream
+    calls are made once, and every stop's name and transfers come from
+    the same snapshots.
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        stop_ids = split_ids(body.get('stop_ids') or [])
+        routes = set(split_ids(body.get('routes') or []))
+    else:
+        stop_ids = split_ids(request.args.getlist('stop_id'))
+        routes = set(split_ids(request.args.getlist('route')))
+
+    stop_ids = list(dict.fromkeys(clean_stop_id(stop_id) for stop_id in stop_ids))
+    if not stop_ids:
+        return jsonify({'error': 'stop_id is required'}), 400
+    if len(stop_ids) > MAX_BATCH_STOPS:
+        return jsonify({'error': f'at most {MAX_BATCH_STOPS} stops per request'}), 400
+
+    # One concurrent fetch for every stop; the helpers below read the memo
+    get_stop_snapshots(stop_ids)
+
+    stops = []
+    for stop_id in stop_ids:
+        stops.append({
+            'stop_id': stop_id,
+            'stop_name': get_stop_name(stop_id),
+            'train_info': get_train_info(stop_id, routes),
+            'transfers': get_transfers_for_stop(stop_id)
+        })
+    return jsonify({'stops': stops})
+
+MAX_NEARBY_STATIONS = 20
+
+@app.route('/nearby', methods=['GET'])
+def nearby():
+    """Closest parent stations to ?lat=&lon=, with live trains if ?arrivals=1.
+
+    Optional k (default 5) and radius in meters.
+    """
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        k = min(int(request.args.get('k', 5)), MAX_NEARBY_STATIONS)
+        radius = request.args.get('radius', type=float)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat and lon are required numbers, k an integer'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or k < 1:
+        return jsonify({'error': 'lat/lon out of range or k < 1'}), 400
+
+    nearest = get_station_grid('stops.txt').nearest(lat, lon, k, radius)
+    with_arrivals = request.args.get('arrivals') in ('1', 'true')
+    if with_arrivals:
+        get_stop_snapshots([stop.stop_id for _, stop in nearest])
+
+    topology = get_topology()
+    stations = []
+    for distance, stop in nearest:
+        station = {
+            'stop_id': stop.stop_id,
+            'stop_name': stop.stop_name,
+            'stop_lat': stop.stop_lat,
+            'stop_lon': stop.stop_lon,
+            'distance_m': round(distance),
+            'routes': topology.routes_for_stop(stop.stop_id)
+        }
+        if with_arrivals:
+            station['train_info'] = get_train_info(stop.stop_id)
+        stations.append(station)
+    return jsonify({'stations': stations})
+
+SYSTEM_TIMEZONE = ZoneInfo('America/New_York')
+
+def resolve_station(value):
+    """A parent station id for an id or a station name, or None."""
+    stop = get_stop_index('stops.txt').get(clean_stop_id(value))
+    if stop is not None:
+        return stop.parent_station or stop.stop_id
+    matches = get_station_search('stops.txt').search(value, limit=1)
+    return matches[0]['stop_id'] if matches else None
+
+def parse_depart(value):
+    """Departure time from epoch seconds, HH:MM (today) or ISO 8601; now if empty."""
+    now = datetime.fromtimestamp(int(clock.now()), SYSTEM_TIMEZONE)
+    if not value:
+        return now
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), SYSTEM_TIMEZONE)
+    if len(value) <= 5 and ':' in value:
+        hour, minute = value.split(':')
+        return now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+    depart = datetime.fromisoformat(value)
+    if depart.tzinfo is None:
+        return depart.replace(tzinfo=SYSTEM_TIMEZONE)
+    return depart.astimezone(SYSTEM_TIMEZONE)
+
+def live_departures(stop_id, midnight, after):
+    """(seconds of day, route_id, direction) for live trains leaving stop_id's platforms."""
+    departures = []
+    platforms = [f"{stop_id}N", f"{stop_id}S"]
+    for platform, snapshot in get_stop_snapshots(platforms).items():
+        if snapshot is None:
+            continue
+        for stop_time in snapshot.upcoming(after):
+            departures.append((int(stop_time.departure_time - midnight), stop_time.route_id, platform[-1]))
+    return departures
+
+@app.route('/plan', methods=['GET'])
+def plan():
+    """Journeys from ?from= to ?to= (station ids or names), leaving at ?depart=.
+
+    Times are estimates from journey_planner's synthesized timetable;
+    live=0 skips lining trips up with the origin's live departures.
+    Stations the timetable can't route between get a 422.
+    """
+    from_stop_id = resolve_station(request.args.get('from', ''))
+    to_stop_id = resolve_station(request.args.get('to', ''))
+    if from_stop_id is None or to_stop_id is None:
+        return jsonify({'error': 'from and to must be station ids or names'}), 400
+    try:
+        depart = parse_depart(request.args.get('depart', ''))
+    except ValueError:
+        return jsonify({'error': 'depart must be epoch seconds, HH:MM or ISO 8601'}), 400
+
+    midnight = depart.replace(hour=0, minute=0, second=0, microsecond=0)
+    timetable = get_timetable()
+    stop_index = get_stop_index('stops.txt')
+    for stop_id in (from_stop_id, to_stop_id):
+        if not timetable.serves(stop_id):
+            return jsonify({'error': f'{stop_index.get(stop_id).stop_name} ({stop_id}) is on no service the planner can route'}), 422
+    shifts = {}
+    if request.args.get('live', '1') != '0':
+        departures = live_departures(from_stop_id, midnight.timestamp(), depart.timestamp())
+        shifts = timetable.align_to_departures(from_stop_id, departures)
+
+    def iso_at(seconds):
+        return (midnight + timedelta(seconds=seconds)).isoformat()
+
+    journeys = []
+    depart_seconds = int((depart - midnight).total_seconds())
+    for legs in timetable.plan(from_stop_id, to_stop_id, depart_seconds, shifts):
+        for leg in legs:
+            leg['from_stop_name'] = stop_index.get(leg['from_stop_id']).stop_name
+            leg['to_stop_name'] = stop_index.get(leg['to_stop_id']).stop_name
+            if leg['type'] == 'ride':
+                leg['route_name'] = get_line_name(leg['service'])
+                leg['depart'] = iso_at(leg['depart'])
+                leg['arrive'] = iso_at(leg['arrive'])
+        arrive = next(leg['arrive'] for leg in reversed(legs) if leg['type'] == 'ride')
+        journeys.append({
+            'arrive': arrive,
+            'rides': sum(1 for leg in legs if leg['type'] == 'ride'),
+            'legs': legs
+        })
+    if not journeys:
+        return jsonify({'error': f'no journey from {from_stop_id} to {to_stop_id} in the timetable'}), 422
+
+    return jsonify({
+        'from': {'stop_id': from_stop_id, 'stop_name': stop_index.get(from_stop_id).stop_name},
+        'to': {'stop_id': to_stop_id, 'stop_name': stop_index.get(to_stop_id).stop_name},
+        'depart': depart.isoformat(),
+        # Ride times come from the synthesized timetable, not a schedule
+        'estimated': True,
+        'journeys': journeys
+    })
+
+@app.route('/headways/<stop_id>', methods=['GET'])
+def headways(stop_id):
+    """Observed headway stats for a station, per route and direction (seconds)."""
+    stop_id = clean_stop_id(stop_id)
+    # Viewing a station's headways keeps its platforms watched by the poller
+    get_stop_snapshots([f"{stop_id}N", f"{stop_id}S"])
+    return jsonify({'stop_id': stop_id, 'headways': headway_engine.stats_for_station(stop_id)})
+
+MAX_HISTORY_DAYS = 31
+
+@app.route('/history', methods=['GET'])
+def history():
+    """Recorded departures at ?stop_id= (optionally one ?route=) between ?start= and ?end=.
+
+    Times take the same formats as /plan's depart; the default is the
+    last hour.
+    """
+    if arrival_history is None:
+        return jsonify({'error': 'arrival history is disabled'}), 404
+    stop_id = clean_stop_id(request.args.get('stop_id', ''))
+    if not stop_id:
+        return jsonify({'error': 'stop_id is required'}), 400
+    try:
+        end = parse_depart(request.args.get('end', ''))
+        start = parse_depart(request.args.get('start', '')) if request.args.get('start') else end - timedelta(hours=1)
+    except ValueError:
+        return jsonify({'error': 'start and end must be epoch seconds, HH:MM or ISO 8601'}), 400
+    if not start <= end <= start + timedelta(days=MAX_HISTORY_DAYS):
+        return jsonify({'error': f'end must be after start and within {MAX_HISTORY_DAYS} days of it'}), 400
+
+    departures = arrival_history.query(stop_id, start.timestamp(), end.timestamp(), request.args.get('route'))
+    return jsonify({'stop_id': stop_id, 'start': start.isoformat(), 'end': end.isoformat(), 'departures': departures})
+
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
     if request.method == 'POST':
@@ -622,63 +763,61 @@ def settings():
 @app.route('/stop/<stop_id>')
 def stop(stop_id):
     # Clean the stop_id by removing any /realtime suffix
-    if '/realtime' in stop_id:
-        stop_id = stop_id.replace('/realtime', '')
-        
-    url = f"{TRANSITER_BASE_URL}/systems/us-ny-subway/stops/{stop_id}"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        station_name = data.get('name', 'Unknown Station')
-        
-        # Get the lines_stations data
-        lines_stations = parse_stops(r"stops.txt")
-        
-        # Get upcoming trains
-        train_info = get_train_info(stop_id)
-        
-        # Calculate arrival times
-        current_time = time.time()
-        for info in train_info:
-            if info['departure_in_minutes'] is not None:
-                arrival_time_sec = info['departure_in_minutes'] * 60
-                info['arrival_time'] = max(1, int(arrival_time_sec / 60)) if arrival_time_sec > 0 else None
-            else:
-                info['arrival_time'] = None
-            
-            # Extract just the route ID (number or letter)
-            info['route_id'] = info['line'].split()[0]
+    stop_id = clean_stop_id(stop_id)
 
-        # Sort by arrival time
-        train_info.sort(key=lambda x: x['arrival_time'] if x['arrival_time'] is not None else float('inf'))
-        
-        # Get transfers and headways
-        transfers = get_transfers_for_stop(stop_id)
-        headways = get_headways_for_stop(stop_id)
-        
-        settings = session.get('settings', DEFAULT_SETTINGS)
-        return render_template('traininfo.html', 
-                            station_name=station_name,
-                            trains=train_info,
-                            transfers=transfers,
-                            headways=headways,
-                            settings=settings)
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching stop info for {stop_id}: {e}")
+    snapshot = get_stop_snapshot(stop_id)
+    if snapshot is None:
         return "Station not found", 404
 
+    station_name = snapshot.name
+    
+    # Get upcoming trains
+    train_info = get_train_info(stop_id)
+    
+    # Calculate arrival times
+    for info in train_info:
+        if info['departure_in_minutes'] is not None:
+            arrival_time_sec = info['departure_in_minutes'] * 60
+            info['arrival_time'] = max(1, int(arrival_time_sec / 60)) if arrival_time_sec > 0 else None
+        else:
+            info['arrival_time'] = None
+        
+        # Extract just the route ID (number or letter)
+        info['route_id'] = info['line'].split()[0]
+
+    # Sort by arrival time
+    train_info.sort(key=lambda x: x['arrival_time'] if x['arrival_time'] is not None else float('inf'))
+    
+    # Get transfers and headways
+    transfers = get_transfers_for_stop(stop_id)
+    headways = get_headways_for_stop(stop_id)
+    
+    settings = session.get('settings', DEFAULT_SETTINGS)
+    return render_template('traininfo.html', 
+                        station_name=station_name,
+                        trains=train_info,
+                        transfers=transfers,
+                        headways=headways,
+                        settings=settings)
+
 @app.route('/update_font', methods=['POST'])
 def update_font():
     font_link = request.form.get('font_link', '')
-    session['settings']['font_link'] = font_link
+    # Assign a new dict: in-place changes aren't seen by the session, and
+    # a first-time visitor has no settings yet
+    settings = dict(session.get('settings', DEFAULT_SETTINGS))
+    settings['font_link'] = font_link
+    session['settings'] = settings
     return redirect(url_for('settings'))
 
 @app.route('/update_font_size', methods=['POST'])
 def update_font_size():
     font_size = request.form.get('font_size', '16')
-    session['settings']['font_size'] = font_size
+    # Assign a new dict: in-place changes aren't seen by the session, and
+    # a first-time visitor has no settings yet
+    settings = dict(session.get('settings', DEFAULT_SETTINGS))
+    settings['font_size'] = font_size
+    session['settings'] = settings
     return redirect(url_for('settings'))
 
 @app.route('/update_settings', methods=['POST'])
@@ -1,9 +1,12 @@
 import csv
-import time
 import requests
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session
 from flask_session import Session
 from datetime import datetime
+import clock
+from stop_snapshot import fetch_stop_snapshots
+from transiter import fetch_json
+from trip_progress import get_trip_progress
 
 app = Flask(__name__, template_folder="templates")
 app.secret_key = 'your-secret-key-here'
@@ -15,12 +18,9 @@ DEFAULT_SETTINGS = {
 
 def get_line_name(stop_id):
     route_id = stop_id[0]
-    base_url = f"https://demo.transiter.dev/systems/us-ny-subway/routes/{route_id}"
 
     try:
-        response = requests.get(base_url)
-        response.raise_for_status()
-        route_data = response.json()
+        route_data = fetch_json(f"/routes/{route_id}")
         train_name = route_data.get("shortName", "Unknown Train")
         return train_name
     except requests.exceptions.RequestException as e:
@@ -89,87 +89,77 @@ def get_upcoming_trains_for_stop(stop_id, lines_stations):
     all_train_info = []
     seen_trains = set()
     
+    # Fetch the parent stop and both platforms concurrently
+    snapshots = fetch_stop_snapshots(stop_ids)
+
+    now = clock.now()
+    selected = []
     for current_stop_id in stop_ids:
-        url = f"https://demo.transiter.dev/systems/us-ny-subway/stops/{current_stop_id}"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-        except (requests.exceptions.RequestException, KeyError, IndexError) as e:
-            print(f"Error fetching data for stop {current_stop_id}: {e}")
+        snapshot = snapshots[current_stop_id]
+        if snapshot is None:
             continue
 
-        now = time.time()
-        upcoming_trains = [stop_time for stop_time in data.get("stopTimes", []) if int(stop_time["departure"].get("time", 0)) > now]
-
+        upcoming_trains = [stop_time for stop_time in snapshot.stop_times if (stop_time.departure_time or 0) > now]
         for stop_time in upcoming_trains[:2]:  # Limit to the next 2 trains
-            departure_time = stop_time.get("departure", {}).get("time", None)
+            selected.append((current_stop_id, stop_time))
 
-            if departure_time is None:
-                print(f"Skipping train info due to missing departure time for stop {current_stop_id}")
-                continue
+    # Stop sequences for every listed trip in one concurrent batch; trips
+    # already cached for another station need no fetch
+    trip_progress = get_trip_progress(stop_time.trip_id for _, stop_time in selected)
 
-            seconds_to_leave = int(departure_time) - now
-            minutes, _ = divmod(seconds_to_leave, 60)
+    for current_stop_id, stop_time in selected:
+        departure_time = stop_time.departure_time
 
-            trip_info = stop_time.get("trip", {})
-            route_id = trip_info.get("route", {}).get("id", "Unknown")
-            route_name = get_line_name(route_id)
-            destination = trip_info.get("destination", {}).get("name", "Unknown")
-            headsign = stop_time.get("headsign", "Unknown")
-            trip_id = trip_info.get("id", "Unknown")
-            
-            # Fetch the next stop after the current one for this trip
-            next_stop_url = f"https://demo.transiter.dev/systems/us-ny-subway/trips/{trip_id}/stop_times"
-            try:
-                next_stop_response = requests.get(next_stop_url)
-                next_stop_response.raise_for_status()
-                next_stop_data = next_stop_response.json()
-                next_stop = next_stop_data[1]["stop"]["name"] if len(next_stop_data) > 1 else None
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching next stop data for trip {trip_id}: {e}")
-                next_stop = None
-
-            if destination == "Unknown":
-                destination = "No destination available"
-            if route_name == "Unknown Line":
-                route_name = "No route available"
-
-            train_details = f"to {destination} [{headsign}] leaves in {int(minutes)} min"
-
-            if train_details not in seen_trains:
-                seen_trains.add(train_details)
-                train_info = {
-                    "train_details": train_details,
-                    "trip_id": trip_id,
-                    "destination": destination,
-                    "headsign": headsign,
-                    "departure_time": departure_time,
-                    "departure_in_minutes": int(minutes),
-                    "route_name": route_name,
-                    "next_stop": next_stop
-                }
-                all_train_info.append(train_info)
+        if departure_time is None:
+            print(f"Skipping train info due to missing departure time for stop {current_stop_id}")
+            continue
+
+        seconds_to_leave = int(departure_time) - now
+        minutes, _ = divmod(seconds_to_leave, 60)
+
+        route_name = get_line_name(stop_time.route_id)
+        destination = stop_time.destination
+        headsign = stop_time.headsign
+        trip_id = stop_time.trip_id
+
+        # The next stop after the current one for this trip
+        progress = trip_progress.get(trip_id)
+        next_stop = progress.next_stop_after(current_stop_id) if progress is not None else None
+
+        if destination == "Unknown":
+            destination = "No destination available"
+        if route_name == "Unknown Line":
+            route_name = "No route available"
+
+        train_details = f"to {destination} [{headsign}] leaves in {int(minutes)} min"
+
+        if train_details not in seen_trains:
+            seen_trains.add(train_details)
+            train_info = {
+                "train_details": train_details,
+                "trip_id": trip_id,
+                "destination": destination,
+                "headsign": headsign,
+                "departure_time": departure_time,
+                "departure_in_minutes": int(minutes),
+                "route_name": route_name,
+                "next_stop": next_stop
+            }
+            all_train_info.append(train_info)
     
     return all_train_info
 
 def get_stop_name(stop_id):
-    url = f"https://demo.transiter.dev/systems/us-ny-subway/stops/{stop_id}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_json(f"/stops/{stop_id}")
         return data["name"]
     except requests.exceptions.RequestException as e:
         print(f"Error fetching station name for {stop_id}: {e}")
         return "Unknown Station"
 
 def get_transfers_for_stop(stop_id):
-    url = f"https://demo.transiter.dev/systems/us-ny-subway/stops/{stop_id}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_json(f"/stops/{stop_id}")
 
         transfers = data.get('transfers', [])
         processed_transfers = []
@@ -215,7 +205,7 @@ def train_info(stop_id):
     transfers = get_transfers_for_stop(stop_id)
     
     # Calculate arrival time in minutes
-    current_time = time.time()
+    current_time = clock.now()
     for info in train_info:
         if info['departure_time'] is not None:
             arrival_time_sec = int(info['departure_time']) - current_time
@@ -227,7 +217,7 @@ def train_info(stop_id):
     train_info.sort(key=lambda x: x['arrival_time'] if x['arrival_time'] is not None else float('inf'))
 
     # Get current time for display
-    current_time = datetime.now().strftime("%I:%M %p")
+    current_time = datetime.fromtimestamp(clock.now()).strftime("%I:%M %p")
 
     return render_template('traininfo.html', 
                          stop_name=stop_name,
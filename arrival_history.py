@@ -0,0 +1,248 @@
+"""Arrival history kept on disk, one SQLite file per service day.
+
+Platform snapshots from the arrivals source are compared with the
+previous one for the same platform, the way headway_engine spots
+departures: a train that drops off the list close to or past its
+predicted departure has left, at min(predicted departure, now). Only
+those departures are queued, and a background thread writes each into
+the file of the day it left, so trains still to come and cancelled
+trips never reach the history. Rows are keyed by (stop, trip). Stop,
+route and trip ids are interned into a strings table, leaving a
+departures row at three integers plus the departure time.
+
+Whole days are dropped by deleting their file once they are older than
+the retention period.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import clock
+from headway_engine import DEPARTURE_GRACE, MAX_OBSERVATION_GAP, STALE_PLATFORM_SECONDS
+
+
+SYSTEM_TIMEZONE = ZoneInfo('America/New_York')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS departures (
+    stop INTEGER NOT NULL,
+    trip INTEGER NOT NULL,
+    route INTEGER NOT NULL,
+    departure INTEGER NOT NULL,
+    PRIMARY KEY (stop, trip)
+) WITHOUT ROWID;
+-- Covers "stop, optional route, time range" queries without touching the table
+CREATE INDEX IF NOT EXISTS departures_by_time ON departures (stop, departure, route, trip);
+"""
+
+
+def service_day(timestamp):
+    return datetime.fromtimestamp(timestamp, SYSTEM_TIMEZONE).date()
+
+
+class ArrivalHistory:
+    def __init__(self, directory, retention_days=180):
+        self.directory = directory
+        self.retention_days = retention_days
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue(maxsize=1000)
+        self._connections = {}   # day -> writer connection, used by the writer thread only
+        self._strings = {}       # day -> {value: id}
+        self._pending = {}       # platform -> (observed_at, {trip_id: (route_id, departure)})
+        self._pending_lock = threading.Lock()
+        self._thread = None
+
+    def path_for(self, day):
+        return os.path.join(self.directory, f"arrivals-{day.isoformat()}.sqlite")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='arrival-history', daemon=True)
+            self._thread.start()
+
+    def departures(self, stop_id, stop_times, now):
+        """(stop_id, trip_id, route_id, departed_at) for trains that left stop_id since its last observation.
+
+        A platform not observed for MAX_OBSERVATION_GAP starts over, since
+        trains missing from its list may have left at any time in between.
+        """
+        current = {
+            stop_time.trip_id: (stop_time.route_id, stop_time.departure_time)
+            for stop_time in stop_times if stop_time.trip_id != "Unknown"
+        }
+        with self._pending_lock:
+            observed_at, previous = self._pending.get(stop_id, (None, {}))
+            self._pending[stop_id] = (now, current)
+        if observed_at is None or now - observed_at > MAX_OBSERVATION_GAP:
+            return []
+        return [
+            (stop_id, trip_id, route_id, int(min(departure, now)))
+            for trip_id, (route_id, departure) in previous.items()
+            if trip_id not in current and departure <= now + DEPARTURE_GRACE
+        ]
+
+    def record_snapshots(self, snapshots, now=None):
+        """Arrivals listener: queue the departures since each platform's last snapshot, never blocking."""
+        if now is None:
+            now = clock.now()
+        rows = [
+            row
+            for stop_id, snapshot in snapshots.items()
+            if snapshot is not None and stop_id[-1:] in ('N', 'S')
+            for row in self.departures(stop_id, snapshot.stop_times, now)
+        ]
+        with self._pending_lock:
+            for platform, (observed_at, _) in list(self._pending.items()):
+                if now - observed_at > STALE_PLATFORM_SECONDS:
+                    del self._pending[platform]
+        if not rows:
+            return
+        try:
+            self._queue.put_nowait(rows)
+        except queue.Full:
+            print("Arrival history is falling behind; dropping a snapshot batch")
+
+    def _run(self):
+        last_prune = 0
+        while True:
+            batches = [self._queue.get()]
+            while not self._queue.empty() and len(batches) < 50:
+                batches.append(self._queue.get_nowait())
+            try:
+                self.write(row for rows in batches for row in rows)
+                if time.time() - last_prune > 3600:
+                    self.prune()
+                    last_prune = time.time()
+            except sqlite3.Error as e:
+                print(f"Error writing arrival history: {e}")
+
+    def _writer(self, day):
+        connection = self._connections.get(day)
+        if connection is None:
+            # Only today's and yesterday's files still get writes
+            for old_day in [d for d in self._connections if d < day - timedelta(days=1)]:
+                self._connections.pop(old_day).close()
+                self._strings.pop(old_day, None)
+            connection = sqlite3.connect(self.path_for(day))
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connections[day] = connection
+            self._strings[day] = dict(connection.execute("SELECT value, id FROM strings"))
+        return connection
+
+    def _intern(self, day, connection, value, added):
+        """Id of value in day's strings table, adding it if needed.
+
+        Other processes may be writing the same file, so a string missing
+        from this process's cache may already exist with another id. New
+        ids go into `added` and only reach the cache once the transaction
+        commits.
+        """
+        string_id = self._strings[day].get(value) or added.get(value)
+        if string_id is None:
+            connection.execute("INSERT OR IGNORE INTO strings (value) VALUES (?)", (value,))
+            string_id, = connection.execute("SELECT id FROM strings WHERE value = ?", (value,)).fetchone()
+            added[value] = string_id
+        return string_id
+
+    def write(self, rows):
+        """Upsert (stop_id, trip_id, route_id, departure) rows into the file of the day they departed."""
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(service_day(row[3]), []).append(row)
+        for day, day_rows in by_day.items():
+            connection = self._writer(day)
+            added = {}
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO departures (stop, trip, route, departure) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (stop, trip) DO UPDATE SET departure = excluded.departure, route = excluded.route",
+                        [
+                            (self._intern(day, connection, stop_id, added),
+                             self._intern(day, connection, trip_id, added),
+                             self._intern(day, connection, route_id, added), departure)
+                            for stop_id, trip_id, route_id, departure in day_rows
+                        ]
+                    )
+            except sqlite3.Error:
+                # Ids cached from a rolled-back transaction could point at other strings later
+                self._strings[day].clear()
+                raise
+            self._strings[day].update(added)
+
+    def prune(self, today=None):
+        """Delete day files older than the retention period."""
+        cutoff = (today or service_day(clock.now())) - timedelta(days=self.retention_days)
+        for name in os.listdir(self.directory):
+            if not (name.startswith('arrivals-') and name.endswith('.sqlite')):
+                continue
+            try:
+                day = date.fromisoformat(name[len('arrivals-'):-len('.sqlite')])
+            except ValueError:
+                continue
+            if day < cutoff:
+                for suffix in ('', '-wal', '-shm'):
+                    try:
+                        os.remove(os.path.join(self.directory, name + suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def query(self, stop_id, start, end, route_id=None):
+        """Departures at stop_id between epoch seconds start and end, oldest first.
+
+        A station id covers both of its platforms. Returns dicts with
+        stop_id, route_id, trip_id and departure.
+        """
+        stop_ids = [stop_id] if stop_id[-1:] in ('N', 'S') else [f"{stop_id}N", f"{stop_id}S"]
+        results = []
+        day = service_day(start)
+        while day <= service_day(end):
+            path = self.path_for(day)
+            day += timedelta(days=1)
+            if not os.path.exists(path):
+                continue
+            connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                results.extend(self._query_day(connection, stop_ids, start, end, route_id))
+            finally:
+                connection.close()
+        results.sort(key=lambda row: row['departure'])
+        return results
+
+    def _query_day(self, connection, stop_ids, start, end, route_id):
+        names = stop_ids + ([route_id] if route_id else [])
+        marks = ','.join('?' * len(names))
+        ids = dict(connection.execute(f"SELECT value, id FROM strings WHERE value IN ({marks})", names))
+        stops = [ids[stop_id] for stop_id in stop_ids if stop_id in ids]
+        if not stops or (route_id and route_id not in ids):
+            return []
+
+        sql = (f"SELECT s.value, r.value, t.value, d.departure FROM departures d "
+               f"JOIN strings s ON s.id = d.stop JOIN strings r ON r.id = d.route JOIN strings t ON t.id = d.trip "
+               f"WHERE d.stop IN ({','.join('?' * len(stops))}) AND d.departure BETWEEN ? AND ?")
+        params = stops + [int(start), int(end)]
+        if route_id:
+            sql += " AND d.route = ?"
+            params.append(ids[route_id])
+        return [
+            {'stop_id': stop, 'route_id': route, 'trip_id': trip, 'departure': departure}
+            for stop, route, trip, departure in connection.execute(sql, params)
+        ]
+
+
+def arrival_history_from_env():
+    """ArrivalHistory in ARRIVAL_HISTORY_DIR (default history/), or None if it is set empty."""
+    directory = os.environ.get('ARRIVAL_HISTORY_DIR', 'history')
+    if not directory:
+        return None
+    return ArrivalHistory(directory, retention_days=int(os.environ.get('ARRIVAL_HISTORY_DAYS', '180')))
@@ -0,0 +1,125 @@
+import threading
+import time
+
+from stop_snapshot import fetch_stop_snapshots
+
+
+class ArrivalsPoller:
+    """Shared store of stop snapshots, refreshed in the background.
+
+    Every stop a page asks for is added to the watched set. A daemon thread
+    re-fetches all watched stops once per `interval`, so any number of
+    screens showing the same stop cost one upstream fetch per interval.
+    Stops nobody has asked for in `watch_ttl` seconds are dropped.
+    `version` goes up on every store so push streams can wait for changes.
+    """
+
+    def __init__(self, interval=15, watch_ttl=120):
+        self.interval = interval
+        self.watch_ttl = watch_ttl
+        # Served snapshots older than this are re-fetched on the request path
+        self.max_age = interval * 3
+        self._snapshots = {}
+        self._watched = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self.version = 0
+        # Called with every stored {stop_id: snapshot} batch, outside the lock
+        self.listeners = []
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name='arrivals-poller', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            started = time.time()
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Error polling arrivals: {e}")
+            time.sleep(max(0, self.interval - (time.time() - started)))
+
+    def poll_once(self):
+        """Refresh every watched stop and forget the ones nobody is viewing."""
+        now = time.time()
+        with self._lock:
+            for stop_id, last_seen in list(self._watched.items()):
+                if now - last_seen > self.watch_ttl:
+                    del self._watched[stop_id]
+                    self._snapshots.pop(stop_id, None)
+            stop_ids = list(self._watched)
+        if stop_ids:
+            self._store(fetch_stop_snapshots(stop_ids, fresh=True))
+
+    def _store(self, snapshots):
+        fetched_at = time.time()
+        with self._lock:
+            for stop_id, snapshot in snapshots.items():
+                # A failed refresh keeps the last good snapshot until it ages out
+                if snapshot is not None:
+                    self._snapshots[stop_id] = (fetched_at, snapshot)
+            self.version += 1
+            self._updated.notify_all()
+        for listener in self.listeners:
+            try:
+                listener(snapshots)
+            except Exception as e:
+                print(f"Error in arrivals listener: {e}")
+
+    def wait_for_update(self, version, timeout=None):
+        """Block until the store moves past `version` (or timeout); returns the current version."""
+        with self._updated:
+            if version == self.version:
+                self._updated.wait(timeout)
+            return self.version
+
+    def get(self, stop_id):
+        return self.get_many([stop_id])[stop_id]
+
+    def get_many(self, stop_ids):
+        """Snapshots for stop_ids, fetching only what the store doesn't hold.
+
+        Concurrent requests for the same missing stop share one fetch.
+        """
+        now = time.time()
+        result = {}
+        to_fetch = []
+        to_wait = []
+        with self._lock:
+            for stop_id in stop_ids:
+                self._watched[stop_id] = now
+                entry = self._snapshots.get(stop_id)
+                if entry is not None and now - entry[0] <= self.max_age:
+                    result[stop_id] = entry[1]
+                elif stop_id in self._inflight:
+                    to_wait.append((stop_id, self._inflight[stop_id]))
+                else:
+                    self._inflight[stop_id] = threading.Event()
+                    to_fetch.append(stop_id)
+
+        if to_fetch:
+            try:
+                fetched = fetch_stop_snapshots(to_fetch)
+                self._store(fetched)
+                result.update(fetched)
+            finally:
+                with self._lock:
+                    for stop_id in to_fetch:
+                        self._inflight.pop(stop_id).set()
+
+        for stop_id, event in to_wait:
+            event.wait()
+            with self._lock:
+                entry = self._snapshots.get(stop_id)
+            result[stop_id] = entry[1] if entry is not None else None
+
+        return result
+
+    def watched_stops(self):
+        with self._lock:
+            return list(self._watched)
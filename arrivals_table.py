@@ -0,0 +1,151 @@
+from array import array
+from bisect import bisect_right
+
+import clock
+from stop_index import get_stop_index
+from stop_snapshot import StopSnapshot, StopTime
+
+
+# Departures per stop in the snapshots pages get: enough for four board
+# rows after parent/platform duplicates, a route filter, and the planner's
+# soonest train per service and direction
+SNAPSHOT_DEPARTURES = 32
+
+
+class ArrivalsTable:
+    """Columnar, read-only table of arrivals for the whole system.
+
+    Rows are grouped by stop and sorted by departure inside each group, so a
+    stop is one contiguous slice found through `offsets`. Route, destination
+    and trip ids are interned into `strings` and stored as int32 indexes;
+    departures are int32 epoch seconds. The next k departures at a stop are
+    a bisect into its slice, not a sort.
+    """
+
+    def __init__(self, strings, offsets, departures, routes, destinations, trips):
+        self.strings = strings
+        self.offsets = offsets
+        self.departures = departures
+        self.routes = routes
+        self.destinations = destinations
+        self.trips = trips
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (stop_id, departure, route_id, destination, trip_id) rows."""
+        strings = []
+        interned = {}
+
+        def intern(value):
+            index = interned.get(value)
+            if index is None:
+                index = interned[value] = len(strings)
+                strings.append(value)
+            return index
+
+        by_stop = {}
+        for stop_id, departure, route_id, destination, trip_id in rows:
+            by_stop.setdefault(stop_id, []).append(
+                (int(departure), intern(route_id), intern(destination), intern(trip_id)))
+
+        offsets = {}
+        departures = array('i')
+        routes = array('i')
+        destinations = array('i')
+        trips = array('i')
+        for stop_id, stop_rows in by_stop.items():
+            stop_rows.sort()
+            start = len(departures)
+            for departure, route, destination, trip in stop_rows:
+                departures.append(departure)
+                routes.append(route)
+                destinations.append(destination)
+                trips.append(trip)
+            offsets[stop_id] = (start, len(departures))
+
+        return cls(strings, offsets, departures, routes, destinations, trips)
+
+    def __len__(self):
+        return len(self.departures)
+
+    @property
+    def nbytes(self):
+        columns = (self.departures, self.routes, self.destinations, self.trips)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def _upcoming_range(self, stop_id, after):
+        start, end = self.offsets.get(stop_id, (0, 0))
+        return bisect_right(self.departures, int(after), start, end), end
+
+    def stop_times(self, stop_id, after=0, k=None):
+        """Upcoming StopTimes for a stop in departure order, at most k of them if k is given."""
+        start, end = self._upcoming_range(stop_id, after)
+        if k is not None:
+            end = min(end, start + k)
+        strings = self.strings
+        return [
+            StopTime(
+                trip_id=strings[self.trips[i]],
+                route_id=strings[self.routes[i]],
+                destination=strings[self.destinations[i]],
+                headsign=strings[self.destinations[i]],
+                departure_time=float(self.departures[i])
+            )
+            for i in range(start, end)
+        ]
+
+
+class ArrivalsTableSource:
+    """Arrivals source behaviour shared by sources that serve an ArrivalsTable.
+
+    Subclasses set self.table, self.version, self._updated (a Condition)
+    and self.listeners, and call _swap_table() with each new table.
+    Readers grab self.table once per call, so swapping the reference is
+    the only update.
+    """
+
+    def _swap_table(self, table):
+        self.table = table
+        with self._updated:
+            self.version += 1
+            self._updated.notify_all()
+        if self.listeners:
+            platforms = [stop_id for stop_id in table.offsets if stop_id[-1:] in ('N', 'S')]
+            snapshots = self.get_snapshots(platforms, k=None)
+            for listener in self.listeners:
+                try:
+                    listener(snapshots)
+                except Exception as e:
+                    print(f"Error in arrivals listener: {e}")
+
+    def wait_for_update(self, version, timeout=None):
+        """Block until the table moves past `version` (or timeout); returns the current version."""
+        with self._updated:
+            if version == self.version:
+                self._updated.wait(timeout)
+            return self.version
+
+    def arrivals_for_stop(self, stop_id, after=None, k=None):
+        """Upcoming StopTimes for a stop (departed trains more than a minute ago are dropped)."""
+        if after is None:
+            after = clock.now() - 60
+        return self.table.stop_times(stop_id, after, k)
+
+    def get_snapshots(self, stop_ids, k=SNAPSHOT_DEPARTURES):
+        """Snapshot source for stop_snapshot.set_snapshot_source.
+
+        Each snapshot holds the next k departures (all of them if k is None).
+        """
+        stop_index = get_stop_index('stops.txt')
+        snapshots = {}
+        for stop_id in stop_ids:
+            stop = stop_index.get(stop_id)
+            if stop is None:
+                snapshots[stop_id] = None
+                continue
+            snapshots[stop_id] = StopSnapshot(
+                stop_id=stop_id,
+                name=stop.stop_name,
+                stop_times=self.arrivals_for_stop(stop_id, k=k)
+            )
+        return snapshots
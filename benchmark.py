@@ -0,0 +1,302 @@
+"""Offline benchmark for the Flask routes against a local Transiter stand-in.
+
+Serves recorded (or generated) Transiter JSON from a local HTTP server with
+configurable latency, points the app at it, drives each route with
+concurrent clients and reports latency percentiles, requests/sec and
+upstream calls per page. Needs no network.
+
+    python benchmark.py --requests 200 --concurrency 16 --latency-ms 40
+    python benchmark.py --fixtures recorded.json --baseline bench_results/old.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SYSTEM_PATH = "/systems/us-ny-subway"
+
+
+def generate_fixtures(seed=0, trains_per_stop=12):
+    """Synthetic Transiter responses for every stop in trunk_line_stops.json.
+
+    Shaped like real /stops/<id> and /routes responses, with departures
+    spread over the next hour relative to recorded_at.
+    """
+    from stop_index import get_stop_index
+    from topology import get_topology
+
+    rng = random.Random(seed)
+    stop_index = get_stop_index('stops.txt')
+    topology = get_topology()
+    recorded_at = int(time.time())
+    responses = {}
+
+    for stop_id, services in topology.stop_services.items():
+        stop = stop_index.get(stop_id)
+        service_stops = [topology.service_stops[service] for service in services]
+        for platform in (stop_id, f"{stop_id}N", f"{stop_id}S"):
+            stop_times = []
+            for i in range(trains_per_stop):
+                index = rng.randrange(len(services))
+                service = services[index]
+                terminal = rng.choice((service_stops[index][0], service_stops[index][-1]))
+                stop_times.append({
+                    "trip": {
+                        "id": f"{service}-{platform}-{i}",
+                        "route": {"id": service},
+                        "destination": {"id": terminal, "name": stop_index.get(terminal).stop_name},
+                    },
+                    "departure": {"time": str(recorded_at + rng.randint(0, 3600))},
+                    "headsign": rng.choice(["Uptown", "Downtown"]),
+                })
+            stop_times.sort(key=lambda stop_time: int(stop_time["departure"]["time"]))
+            responses[f"{SYSTEM_PATH}/stops/{platform}"] = {
+                "id": platform,
+                "name": stop.stop_name,
+                "route": {"id": services[0]},
+                "stopTimes": stop_times,
+                "transfers": [
+                    {"fromStop": {"id": stop_id, "name": stop.stop_name},
+                     "toStop": {"id": other, "name": stop_index.get(other).stop_name},
+                     "type": "RECOMMENDED", "minTransferTime": 180}
+                    for other in rng.sample(list(topology.stop_services), 2)
+                ],
+            }
+
+    responses[f"{SYSTEM_PATH}/routes"] = {
+        "routes": [{"id": service, "shortName": service} for service in topology.service_stops]
+    }
+    return {"recorded_at": recorded_at, "responses": responses}
+
+
+def shift_times(value, offset):
+    """Move every departure/arrival "time" forward by offset seconds."""
+    if isinstance(value, dict):
+        return {key: (str(int(item) + offset) if key == "time" and isinstance(item, (str, int)) else shift_times(item, offset))
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [shift_times(item, offset) for item in value]
+    return value
+
+
+class FixtureServer:
+    """Local Transiter stand-in serving fixture responses with added latency.
+
+    Recorded times are shifted so the data looks as fresh as when it was
+    recorded. Every request is counted by path.
+    """
+
+    def __init__(self, fixtures, latency_ms=0, jitter_ms=0, port=0):
+        self.recorded_at = fixtures["recorded_at"]
+        self.responses = fixtures["responses"]
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._calls_lock:
+                    server.calls[self.path] += 1
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                body = server.responses.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                payload = json.dumps(shift_times(body, int(time.time()) - server.recorded_at)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def total_calls(self):
+        with self._calls_lock:
+            return sum(self.calls.values())
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fixture-server', daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+def percentile(values, pct):
+    """pct-th percentile of values, or None if there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def run_route(session_factory, app_url, paths, requests_count, concurrency, fixture_server):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def hit(i):
+        nonlocal errors
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = session_factory()
+        started = time.perf_counter()
+        try:
+            response = session.get(f"{app_url}{paths[i % len(paths)]}", timeout=30)
+            ok = response.status_code < 500
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    upstream_before = fixture_server.total_calls()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(hit, range(requests_count)))
+    wall = time.perf_counter() - started
+    upstream_calls = fixture_server.total_calls() - upstream_before
+
+    return {
+        "requests": requests_count,
+        "errors": errors,
+        "p50_ms": to_ms(percentile(latencies, 50)),
+        "p95_ms": to_ms(percentile(latencies, 95)),
+        "p99_ms": to_ms(percentile(latencies, 99)),
+        "mean_ms": to_ms(statistics.mean(latencies) if latencies else None),
+        "requests_per_sec": round(requests_count / wall, 1),
+        "upstream_calls_per_page": round(upstream_calls / requests_count, 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"\nChange vs {baseline.get('git_revision') or 'baseline'}:")
+    for route, stats in results["routes"].items():
+        old = baseline.get("routes", {}).get(route)
+        if not old:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "requests_per_sec", "upstream_calls_per_page"):
+            if old.get(key) and stats[key] is not None:
+                changes.append(f"{key} {(stats[key] - old[key]) / old[key]:+.0%}")
+        print(f"  {route:<16} " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', help="recorded fixture JSON ({recorded_at, responses}); generated if omitted")
+    parser.add_argument('--latency-ms', type=float, default=30, help="added upstream latency per call")
+    parser.add_argument('--jitter-ms', type=float, default=10, help="random extra upstream latency per call")
+    parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--stops', type=int, default=20, help="distinct stops to spread requests over")
+    parser.add_argument('--routes', default='stop,traininfo,service,get_train_info')
+    parser.add_argument('--output', help="where to write results JSON (default bench_results/<time>.json)")
+    parser.add_argument('--baseline', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    if args.requests < 1:
+        parser.error("--requests must be at least 1")
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+
+    if args.fixtures:
+        with open(args.fixtures, 'r', encoding='utf-8') as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = generate_fixtures()
+
+    fixture_server = FixtureServer(fixtures, args.latency_ms, args.jitter_ms)
+    fixture_server.start()
+
+    # The app reads its upstream URL at import time
+    os.environ['TRANSITER_BASE_URL'] = fixture_server.base_url
+    import requests
+    from werkzeug.serving import make_server
+    from app import app
+    from topology import get_topology
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app_server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=app_server.serve_forever, name='app-server', daemon=True).start()
+    app_url = f"http://127.0.0.1:{app_server.server_port}"
+
+    stop_ids = sorted(path.rsplit('/', 1)[1] for path in fixtures["responses"] if '/stops/' in path)
+    stop_ids = [stop_id for stop_id in stop_ids if stop_id[-1] not in ('N', 'S')]
+    stop_ids = random.Random(1).sample(stop_ids, min(args.stops, len(stop_ids)))
+    services = list(get_topology().service_stops)
+    route_paths = {
+        'stop': [f"/stop/{stop_id}" for stop_id in stop_ids],
+        'traininfo': [f"/traininfo/{stop_id}" for stop_id in stop_ids],
+        'service': [f"/service/{service}" for service in services],
+        'get_train_info': [f"/get_train_info?stop_id={stop_id}" for stop_id in stop_ids],
+    }
+
+    results = {
+        "timestamp": int(time.time()),
+        "git_revision": git_revision(),
+        "config": vars(args),
+        "routes": {},
+    }
+    for route in args.routes.split(','):
+        stats = run_route(requests.Session, app_url, route_paths[route], args.requests, args.concurrency, fixture_server)
+        results["routes"][route] = stats
+        print(f"{route:<16} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+              f"p99 {stats['p99_ms']:>8.2f} ms  {stats['requests_per_sec']:>7.1f} req/s  "
+              f"{stats['upstream_calls_per_page']:.2f} upstream/page  {stats['errors']} errors")
+
+    output = args.output or os.path.join('bench_results', f"{results['timestamp']}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+    app_server.shutdown()
+    fixture_server.stop()
+
+
+if __name__ == '__main__':
+    main()
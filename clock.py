@@ -0,0 +1,33 @@
+"""The time arrivals are computed against.
+
+Normally the wall clock. Replay mode (see upstream_archive) switches it to
+a virtual clock that starts at the recording's first response and runs at
+REPLAY_SPEED, so recorded departures look as current as when recorded.
+Anything comparing against upstream departure times uses clock.now();
+timeouts, cache ages and poll intervals stay on real time.
+"""
+import time
+
+
+_start = None
+_real_start = None
+_speed = 1.0
+
+
+def now():
+    if _start is None:
+        return time.time()
+    return _start + (time.time() - _real_start) * _speed
+
+
+def set_virtual(start, speed=1.0):
+    """Make now() return `start` at this moment and advance `speed` times faster than real time."""
+    global _start, _real_start, _speed
+    _real_start = time.time()
+    _start = start
+    _speed = speed
+
+
+def reset():
+    global _start, _real_start
+    _start = _real_start = None
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+import requests
+
+try:
+    from google.transit import gtfs_realtime_pb2
+except ImportError:  # optional: only needed for ARRIVALS_BACKEND=gtfs-rt
+    gtfs_realtime_pb2 = None
+
+from arrivals_table import ArrivalsTable, ArrivalsTableSource
+from metrics import observe_upstream
+from stop_index import get_stop_index
+from upstream_client import upstream_client
+
+
+MTA_FEED_BASE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/"
+
+# Feed group -> MTA feed path. Recorded files are read as <group>.pb
+FEEDS = {
+    'ace': 'nyct%2Fgtfs-ace',
+    'bdfm': 'nyct%2Fgtfs-bdfm',
+    'g': 'nyct%2Fgtfs-g',
+    'jz': 'nyct%2Fgtfs-jz',
+    'nqrw': 'nyct%2Fgtfs-nqrw',
+    'l': 'nyct%2Fgtfs-l',
+    '1234567': 'nyct%2Fgtfs',
+    'sir': 'nyct%2Fgtfs-si',
+}
+
+
+class HttpFeedSource:
+    """Pulls the live MTA GTFS-Realtime feeds."""
+
+    def __init__(self, base_url=MTA_FEED_BASE_URL, api_key=None):
+        self.base_url = base_url
+        self.headers = {'x-api-key': api_key} if api_key else None
+
+    def read(self, feed):
+        started = time.perf_counter()
+        try:
+            response = upstream_client.get(f"{self.base_url}{FEEDS[feed]}", headers=self.headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            observe_upstream('gtfs-rt', type(e).__name__, time.perf_counter() - started)
+            raise
+        observe_upstream('gtfs-rt', 'ok', time.perf_counter() - started)
+        return response.content
+
+
+class FileFeedSource:
+    """Reads recorded feeds from <directory>/<group>.pb, for offline runs."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def read(self, feed):
+        path = os.path.join(self.directory, f"{feed}.pb")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def decode_feed(content, stop_names):
+    """Decode one FeedMessage into ArrivalsTable rows.
+
+    Each stop_time_update is filed under its platform id (e.g. 127N) and its
+    parent station (127). The destination is the trip's last listed stop.
+    """
+    message = gtfs_realtime_pb2.FeedMessage()
+    message.ParseFromString(content)
+
+    rows = []
+    for entity in message.entity:
+        if not entity.HasField('trip_update'):
+            continue
+        trip_update = entity.trip_update
+        updates = trip_update.stop_time_update
+        if not updates:
+            continue
+        trip_id = trip_update.trip.trip_id
+        route_id = trip_update.trip.route_id
+        destination = stop_names.get(updates[-1].stop_id, "Unknown")
+
+        for update in updates:
+            departure_time = update.departure.time or update.arrival.time
+            if not departure_time:
+                continue
+            stop_id = update.stop_id
+            rows.append((stop_id, departure_time, route_id, destination, trip_id))
+            if stop_id[-1:] in ('N', 'S'):
+                rows.append((stop_id[:-1], departure_time, route_id, destination, trip_id))
+    return rows
+
+
+class FeedIndex(ArrivalsTableSource):
+    """System-wide stop -> arrivals index built from the GTFS-RT feeds.
+
+    refresh() decodes every feed group in one pass and swaps in the new
+    index, so one refresh updates every stop instead of one REST call per
+    stop and direction. A feed that fails keeps its previous arrivals.
+    """
+
+    def __init__(self, source, feeds=None, interval=30):
+        if gtfs_realtime_pb2 is None:
+            raise RuntimeError("ARRIVALS_BACKEND=gtfs-rt needs the gtfs-realtime-bindings package")
+        self.source = source
+        self.feeds = list(feeds or FEEDS)
+        self.interval = interval
+        self.updated_at = None
+        self._feed_rows = {}
+        self.table = ArrivalsTable.from_rows(())
+        self.version = 0
+        self._updated = threading.Condition()
+        # Called after each refresh with {platform_id: snapshot} for every platform
+        self.listeners = []
+        self._thread = None
+
+    def refresh(self):
+        stop_index = get_stop_index('stops.txt')
+        stop_names = {stop_id: stop.stop_name for stop_id, stop in stop_index.stops.items()}
+
+        for feed in self.feeds:
+            try:
+                content = self.source.read(feed)
+                if content is None:
+                    continue
+                self._feed_rows[feed] = decode_feed(content, stop_names)
+            except Exception as e:
+                print(f"Error refreshing GTFS-RT feed {feed}: {e}")
+
+        self.updated_at = time.time()
+        self._swap_table(ArrivalsTable.from_rows(row for rows in self._feed_rows.values() for row in rows))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.refresh()
+        if self.interval <= 0:
+            return
+
+        def refresh_loop():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # Keep the loop alive; the next refresh may succeed
+                    print(f"Error refreshing GTFS-RT index: {e}")
+
+        self._thread = threading.Thread(target=refresh_loop, name='gtfs-rt-refresh', daemon=True)
+        self._thread.start()
+
+
+def feed_source_from_env():
+    """FileFeedSource if GTFS_RT_FEED_DIR is set, otherwise the live MTA feeds."""
+    feed_dir = os.environ.get('GTFS_RT_FEED_DIR')
+    if feed_dir:
+        return FileFeedSource(feed_dir)
+    return HttpFeedSource(api_key=os.environ.get('MTA_API_KEY'))
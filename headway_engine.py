@@ -0,0 +1,159 @@
+import threading
+from array import array
+from collections import deque
+
+import clock
+
+
+# Headways kept per (station, route, direction); older ones are overwritten
+WINDOW = 32
+# A headway this far below the rolling mean means trains are bunched
+BUNCHING_RATIO = 0.25
+# Mean and bunching need this many headways before they mean anything
+MIN_SAMPLES = 4
+# A tracked train that vanishes from a platform's list this close to (or
+# past) its predicted departure has departed; earlier disappearances are
+# cancellations or reroutes
+DEPARTURE_GRACE = 90
+# A platform last observed longer ago than this (a few poll intervals) may
+# have seen trains come and go unobserved, so its series start over from
+# the next departure instead of measuring a headway across the hole
+MAX_OBSERVATION_GAP = 180
+# Platforms not observed for this long stop being tracked
+STALE_PLATFORM_SECONDS = 3600
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class HeadwaySeries:
+    """Rolling headways of one route and direction at one station.
+
+    Headways live in a fixed-size ring buffer with a running sum, and the
+    summary is recomputed on every departure, so reading it is O(1) and
+    memory never grows.
+    """
+
+    __slots__ = ('headways', 'count', 'next_slot', 'total', 'last_departure', 'recent_trips', 'stats')
+
+    def __init__(self):
+        self.headways = array('d', [0.0] * WINDOW)
+        self.count = 0
+        self.next_slot = 0
+        self.total = 0.0
+        self.last_departure = None
+        self.recent_trips = deque(maxlen=8)
+        self.stats = None
+
+    def record(self, trip_id, departed_at):
+        if trip_id in self.recent_trips:
+            return
+        self.recent_trips.append(trip_id)
+        if self.last_departure is not None and departed_at > self.last_departure:
+            headway = departed_at - self.last_departure
+            if self.count == WINDOW:
+                self.total -= self.headways[self.next_slot]
+            else:
+                self.count += 1
+            self.headways[self.next_slot] = headway
+            self.total += headway
+            self.next_slot = (self.next_slot + 1) % WINDOW
+            self._summarize(headway)
+        if self.last_departure is None or departed_at > self.last_departure:
+            self.last_departure = departed_at
+
+    def _summarize(self, latest):
+        ordered = sorted(self.headways[:self.count])
+        mean = self.total / self.count
+        self.stats = {
+            'samples': self.count,
+            'mean': round(mean),
+            'p50': round(_percentile(ordered, 50)),
+            'p90': round(_percentile(ordered, 90)),
+            'min': round(ordered[0]),
+            'max': round(ordered[-1]),
+            'last_headway': round(latest),
+            'bunching': self.count >= MIN_SAMPLES and latest < BUNCHING_RATIO * mean,
+        }
+
+
+class HeadwayEngine:
+    """Observed headways built from successive arrival snapshots.
+
+    observe() is fed each platform's upcoming StopTimes (from the arrivals
+    poller or GTFS-RT index). Trains that drop off a platform's list around
+    their predicted departure are counted as departed, and the time between
+    departures of the same route and direction is a headway.
+    """
+
+    def __init__(self):
+        self._series = {}    # station -> {(route_id, direction): HeadwaySeries}
+        self._pending = {}   # platform -> (observed_at, {trip_id: (route_id, departure)})
+        self._lock = threading.Lock()
+
+    def observe(self, stop_id, stop_times, now=None):
+        """Feed one platform's current StopTimes; stations without a direction are ignored."""
+        direction = stop_id[-1:]
+        if direction not in ('N', 'S'):
+            return
+        if now is None:
+            now = clock.now()
+        station = stop_id[:-1]
+        current = {
+            stop_time.trip_id: (stop_time.route_id, stop_time.departure_time)
+            for stop_time in stop_times if stop_time.trip_id != "Unknown"
+        }
+
+        with self._lock:
+            observed_at, previous = self._pending.get(stop_id, (None, {}))
+            if observed_at is None or now - observed_at > MAX_OBSERVATION_GAP:
+                previous = {}
+                for (_, series_direction), series in self._series.get(station, {}).items():
+                    if series_direction == direction:
+                        series.last_departure = None
+            for trip_id, (route_id, departure) in previous.items():
+                if trip_id in current or departure > now + DEPARTURE_GRACE:
+                    continue
+                series = self._series.setdefault(station, {}).get((route_id, direction))
+                if series is None:
+                    series = self._series[station][(route_id, direction)] = HeadwaySeries()
+                series.record(trip_id, min(departure, now))
+            self._pending[stop_id] = (now, current)
+
+            for platform, (observed_at, _) in list(self._pending.items()):
+                if now - observed_at > STALE_PLATFORM_SECONDS:
+                    del self._pending[platform]
+
+    def observe_snapshots(self, snapshots, now=None):
+        """Listener for {stop_id: StopSnapshot or None} batches."""
+        for stop_id, snapshot in snapshots.items():
+            if snapshot is not None:
+                self.observe(stop_id, snapshot.stop_times, now)
+
+    def stats_for_station(self, stop_id, now=None):
+        """Current headway summaries for a station (or platform), one per route and direction."""
+        if now is None:
+            now = clock.now()
+        station = stop_id[:-1] if stop_id[-1:] in ('N', 'S') else stop_id
+        results = []
+        with self._lock:
+            for (route_id, direction), series in self._series.get(station, {}).items():
+                if series.stats is None:
+                    continue
+                stats = dict(series.stats)
+                stats['route_id'] = route_id
+                stats['direction'] = direction
+                # Waiting much longer than usual since the last train is a gap;
+                # unknown while a series waits for its first departure after a hole
+                if series.last_departure is None:
+                    stats['since_last'] = None
+                    stats['gap'] = False
+                else:
+                    stats['since_last'] = round(now - series.last_departure)
+                    stats['gap'] = series.count >= MIN_SAMPLES and now - series.last_departure > 2 * stats['mean']
+                results.append(stats)
+        return results
+
+
+headway_engine = HeadwayEngine()
@@ -0,0 +1,350 @@
+"""Round-based journey planning (RAPTOR) over the subway topology.
+
+The repo has no static stop_times.txt, so the timetable is synthesized from
+the per-service stop sequences in trunk_line_stops.json: every service runs
+in both directions at a fixed headway, with run times estimated from the
+distance between consecutive stations. Live departures at the origin, when
+the arrivals source has them, re-phase that service's trips to the trains
+actually coming. Every time it gives is an estimate.
+
+Some services in trunk_line_stops.json are still placeholders (a few
+stops with far-apart neighbours). Riding those would invent trips, so
+services whose stops aren't a plausible run are left out of the
+timetable, and stations only they serve can't be planned from or to.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from station_geo import haversine_m
+from stop_index import get_stop_index
+from topology import get_topology
+from transfer_graph import get_transfer_graph
+
+
+DAY_SECONDS = 24 * 3600
+# Trips are generated past midnight so late evening plans still find trains
+SERVICE_END = DAY_SECONDS + 3 * 3600
+DEFAULT_HEADWAY = 480
+SERVICE_HEADWAYS = {'GS': 300, 'FS': 600, 'H': 1200, 'SIR': 1800}
+TRAIN_SPEED_MPS = 9  # average including acceleration, about 32 km/h
+DWELL_SECONDS = 30
+# Time to change trains at a station, on top of any transfer walk
+CHANGE_SECONDS = 60
+MIN_RUN_SECONDS = 60
+MAX_ROUNDS = 5
+# Longest run between consecutive stops that skips stations (an express
+# hop such as 59 St to 125 St) or changes lines (the M onto 6 Av)
+MAX_HOP_M = 6000
+INFINITY = 2 ** 31 - 1
+# Live route ids that run as one of the topology's services
+ROUTE_SERVICES = {'5X': '5', '6X': '6', '7X': '7', 'FX': 'F', 'SI': 'SIR'}
+
+
+def platform_directions(sequence):
+    """Platform direction (N or S) at each stop for a train running through sequence in order.
+
+    Stop ids on one line grow in its S direction, so each step between two
+    stops with the same line prefix gives the direction there. Where the
+    service changes lines (the M onto Myrtle Av, say) the direction can
+    flip. Stops between lines take their neighbours' direction.
+    """
+    steps = [
+        ('S' if b > a else 'N') if a[0] == b[0] else None
+        for a, b in zip(sequence, sequence[1:])
+    ]
+    directions = []
+    for i in range(len(sequence)):
+        leaving = steps[i] if i < len(steps) else None
+        arriving = steps[i - 1] if i > 0 else None
+        directions.append(leaving or arriving)
+    # Fill stops with no same-line neighbour from the nearest known one
+    known = next((d for d in directions if d), 'S')
+    for i, direction in enumerate(directions):
+        if direction is None:
+            directions[i] = known
+        else:
+            known = direction
+    return directions
+
+
+def first_gap(sequence, stop_index, line_stations):
+    """First (stop, next stop) of sequence that isn't a plausible run, or None.
+
+    Consecutive stops on one line are fine when no station lies between
+    their ids; a hop that skips stations or changes lines must also be
+    shorter than MAX_HOP_M. line_stations is {line prefix: sorted parent
+    station ids}.
+    """
+    for a, b in zip(sequence, sequence[1:]):
+        if a[0] == b[0]:
+            low, high = sorted((a, b))
+            stations = line_stations.get(a[0], ())
+            if bisect_right(stations, low) == bisect_left(stations, high):
+                continue
+        from_stop, to_stop = stop_index.get(a), stop_index.get(b)
+        if from_stop is None or to_stop is None:
+            return a, b
+        if haversine_m(from_stop.stop_lat, from_stop.stop_lon, to_stop.stop_lat, to_stop.stop_lon) > MAX_HOP_M:
+            return a, b
+    return None
+
+
+class Timetable:
+    """Trip patterns in flat arrays, laid out for RAPTOR scans.
+
+    Pattern p visits pattern_stops[stop_start[p]:stop_start[p + 1]] (stop
+    indexes). Its trips' times are one block of `times` starting at
+    time_start[p]: trip t at the i-th stop is times[time_start[p] + t * n + i],
+    with n stops per trip. Trips in a pattern never overtake, so the
+    earliest usable trip at any stop is a bisect.
+    """
+
+    def __init__(self, topology, stop_index, transfer_graph):
+        self.version = (topology.version, transfer_graph.version)
+        self.stop_ids = []
+        self.stop_position = {}
+        self.pattern_service = []
+        self.pattern_stops = array('i')
+        # Platform direction at each entry of pattern_stops
+        self.stop_directions = []
+        self.stop_start = array('i', [0])
+        self.time_start = array('i')
+        self.trip_counts = array('i')
+        self.times = array('i')
+        # stop index -> [(pattern, position in pattern), ...]
+        self.stop_patterns = []
+
+        line_stations = {}
+        for stop_id in sorted(stop_index.parents):
+            line_stations.setdefault(stop_id[0], []).append(stop_id)
+
+        for service, stop_ids in topology.service_stops.items():
+            if len(stop_ids) < 2:
+                continue
+            gap = first_gap(stop_ids, stop_index, line_stations)
+            if gap is not None:
+                print(f"Leaving service {service} out of the timetable: {gap[0]} -> {gap[1]} is not a run between neighbouring stations")
+                continue
+            directions = platform_directions(stop_ids)
+            reverse = [{'N': 'S', 'S': 'N'}[direction] for direction in reversed(directions)]
+            self._add_pattern(service, stop_ids, directions, stop_index)
+            self._add_pattern(service, stop_ids[::-1], reverse, stop_index)
+
+        self.transfers = [[] for _ in self.stop_ids]
+        for stop, stop_id in enumerate(self.stop_ids):
+            for to_stop_id, min_transfer_time in transfer_graph.neighbors(stop_id):
+                to_stop = self.stop_position.get(to_stop_id)
+                if to_stop is not None:
+                    self.transfers[stop].append((to_stop, min_transfer_time))
+
+    def _stop(self, stop_id):
+        position = self.stop_position.get(stop_id)
+        if position is None:
+            position = self.stop_position[stop_id] = len(self.stop_ids)
+            self.stop_ids.append(stop_id)
+            self.stop_patterns.append([])
+        return position
+
+    def _add_pattern(self, service, sequence, directions, stop_index):
+        pattern = len(self.pattern_service)
+        self.pattern_service.append(service)
+
+        offsets = [0]
+        for previous, stop_id in zip(sequence, sequence[1:]):
+            a, b = stop_index.get(previous), stop_index.get(stop_id)
+            run = haversine_m(a.stop_lat, a.stop_lon, b.stop_lat, b.stop_lon) / TRAIN_SPEED_MPS
+            offsets.append(offsets[-1] + max(MIN_RUN_SECONDS, round(run)) + DWELL_SECONDS)
+
+        for i, stop_id in enumerate(sequence):
+            stop = self._stop(stop_id)
+            self.pattern_stops.append(stop)
+            self.stop_directions.append(directions[i])
+            self.stop_patterns[stop].append((pattern, i))
+        self.stop_start.append(len(self.pattern_stops))
+
+        headway = SERVICE_HEADWAYS.get(service, DEFAULT_HEADWAY)
+        self.time_start.append(len(self.times))
+        trips = 0
+        for first_departure in range(0, SERVICE_END, headway):
+            self.times.extend(first_departure + offset for offset in offsets)
+            trips += 1
+        self.trip_counts.append(trips)
+
+    def serves(self, stop_id):
+        """Whether any service in the timetable calls at stop_id."""
+        return stop_id in self.stop_position
+
+    def stop_count(self, pattern):
+        return self.stop_start[pattern + 1] - self.stop_start[pattern]
+
+    def earliest_trip(self, pattern, i, ready, shift=0):
+        """Index of the first trip leaving the pattern's i-th stop at or after `ready`, or None."""
+        n = self.stop_count(pattern)
+        base = self.time_start[pattern] + i
+        times = self.times
+        trip = bisect_left(range(self.trip_counts[pattern]), ready - shift,
+                           key=lambda t: times[base + t * n])
+        return trip if trip < self.trip_counts[pattern] else None
+
+    def trip_time(self, pattern, trip, i, shift=0):
+        return self.times[self.time_start[pattern] + trip * self.stop_count(pattern) + i] + shift
+
+    def align_to_departures(self, stop_id, departures):
+        """Per-pattern time shifts that line scheduled trips up with live ones.
+
+        departures are (seconds of day, route_id, platform direction) seen
+        at stop_id. The soonest live train of each pattern picks the shift,
+        which moves the nearest scheduled trip onto it.
+        """
+        stop = self.stop_position.get(stop_id)
+        if stop is None:
+            return {}
+        shifts = {}
+        for departure, route_id, direction in sorted(departures):
+            service = ROUTE_SERVICES.get(route_id, route_id)
+            for pattern, i in self.stop_patterns[stop]:
+                if pattern in shifts or self.pattern_service[pattern] != service \
+                        or self.stop_directions[self.stop_start[pattern] + i] != direction:
+                    continue
+                headway = SERVICE_HEADWAYS.get(service, DEFAULT_HEADWAY)
+                trip = self.earliest_trip(pattern, i, departure - headway // 2)
+                if trip is not None:
+                    shifts[pattern] = departure - self.trip_time(pattern, trip, i)
+        return shifts
+
+    def plan(self, from_stop_id, to_stop_id, depart, shifts=None, max_rounds=MAX_ROUNDS):
+        """RAPTOR from one station to another, leaving at `depart` (seconds of day).
+
+        Returns one journey per number of rides that arrives earlier than
+        every journey with fewer rides; each is a list of legs. The list
+        is empty when no journey exists, including when either station is
+        on no service in the timetable (see serves()).
+        """
+        source = self.stop_position.get(from_stop_id)
+        target = self.stop_position.get(to_stop_id)
+        if source is None or target is None:
+            return []
+        shifts = shifts or {}
+        stop_count = len(self.stop_ids)
+
+        best = [INFINITY] * stop_count
+        labels = [[INFINITY] * stop_count]
+        parents = [[None] * stop_count]
+        best[source] = labels[0][source] = depart
+        marked = {source}
+        for to_stop, walk in self.transfers[source]:
+            if depart + walk < best[to_stop]:
+                best[to_stop] = labels[0][to_stop] = depart + walk
+                parents[0][to_stop] = ('transfer', source, walk)
+                marked.add(to_stop)
+
+        for k in range(1, max_rounds + 1):
+            previous = labels[k - 1]
+            change = CHANGE_SECONDS if k > 1 else 0
+            arrival = list(previous)
+            parent = [None] * stop_count
+            labels.append(arrival)
+            parents.append(parent)
+
+            # Each pattern is scanned once, from its earliest marked stop
+            queue = {}
+            for stop in marked:
+                for pattern, i in self.stop_patterns[stop]:
+                    if i < queue.get(pattern, INFINITY):
+                        queue[pattern] = i
+            marked = set()
+
+            for pattern, start in queue.items():
+                shift = shifts.get(pattern, 0)
+                first = self.stop_start[pattern]
+                n = self.stop_count(pattern)
+                trip = None
+                board = None
+                for i in range(start, n):
+                    stop = self.pattern_stops[first + i]
+                    if trip is not None:
+                        time = self.trip_time(pattern, trip, i, shift)
+                        if time < min(best[stop], best[target]):
+                            arrival[stop] = best[stop] = time
+                            parent[stop] = ('ride', pattern, trip, board, i)
+                            marked.add(stop)
+                    ready = previous[stop] + change
+                    if ready < INFINITY and (trip is None or ready <= self.trip_time(pattern, trip, i, shift)):
+                        earlier = self.earliest_trip(pattern, i, ready, shift)
+                        if earlier is not None and earlier != trip:
+                            trip = earlier
+                            board = i
+
+            for stop in list(marked):
+                for to_stop, walk in self.transfers[stop]:
+                    time = arrival[stop] + walk
+                    if time < min(best[to_stop], best[target]):
+                        arrival[to_stop] = best[to_stop] = time
+                        parent[to_stop] = ('transfer', stop, walk)
+                        marked.add(to_stop)
+
+            if not marked:
+                break
+
+        journeys = []
+        best_arrival = INFINITY
+        for k in range(1, len(labels)):
+            if labels[k][target] < best_arrival and parents[k][target] is not None:
+                best_arrival = labels[k][target]
+                journeys.append(self._legs(parents, labels, k, target, shifts))
+        return journeys
+
+    def _legs(self, parents, labels, k, stop, shifts):
+        legs = []
+        while k > 0 or parents[k][stop] is not None:
+            step = parents[k][stop]
+            if step is None:
+                # Reached this round's stop without a ride: carried over from the last round
+                k -= 1
+                continue
+            if step[0] == 'transfer':
+                _, from_stop, walk = step
+                legs.append({
+                    'type': 'transfer',
+                    'from_stop_id': self.stop_ids[from_stop],
+                    'to_stop_id': self.stop_ids[stop],
+                    'seconds': walk
+                })
+                stop = from_stop
+                continue
+            _, pattern, trip, board, alight = step
+            shift = shifts.get(pattern, 0)
+            from_stop = self.pattern_stops[self.stop_start[pattern] + board]
+            legs.append({
+                'type': 'ride',
+                'service': self.pattern_service[pattern],
+                'direction': self.stop_directions[self.stop_start[pattern] + board],
+                'from_stop_id': self.stop_ids[from_stop],
+                'to_stop_id': self.stop_ids[stop],
+                'depart': self.trip_time(pattern, trip, board, shift),
+                'arrive': self.trip_time(pattern, trip, alight, shift),
+                'stops': alight - board,
+                'live': pattern in shifts
+            })
+            stop = from_stop
+            k -= 1
+        legs.reverse()
+        return legs
+
+
+_timetable = None
+_timetable_lock = threading.Lock()
+
+
+def get_timetable():
+    """Shared Timetable, rebuilt when the topology or transfers change."""
+    global _timetable
+    topology = get_topology()
+    transfer_graph = get_transfer_graph()
+    version = (topology.version, transfer_graph.version)
+    if _timetable is None or _timetable.version != version:
+        with _timetable_lock:
+            if _timetable is None or _timetable.version != version:
+                _timetable = Timetable(topology, get_stop_index('stops.txt'), transfer_graph)
+    return _timetable
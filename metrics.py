@@ -0,0 +1,173 @@
+"""Counters and latency histograms exposed in Prometheus text format.
+
+init_app() instruments every Flask route and template render and adds a
+/metrics route. Upstream calls are recorded by transiter.py and the GTFS-RT
+feed reader through observe_upstream(). Set METRICS_TIMING_HEADER=1 to also
+send a Server-Timing header with each response's phase timings.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, before_render_template, g, has_app_context, request, template_rendered
+
+from response_cache import response_cache
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_text(labelnames, labels):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per-bucket counts (the last slot is +Inf), then sum
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, seconds)] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        labelnames = self.labelnames + ('le',)
+        with self._lock:
+            for labels, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_label_text(labelnames, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+upstream_requests = Counter(
+    'upstream_requests_total', "Upstream HTTP calls by endpoint class and outcome", ('endpoint', 'outcome'))
+upstream_seconds = Histogram(
+    'upstream_request_seconds', "Upstream HTTP call latency by endpoint class", ('endpoint',))
+http_requests = Counter(
+    'http_requests_total', "Requests served by Flask endpoint and status", ('endpoint', 'status'))
+http_seconds = Histogram(
+    'http_request_seconds', "Request latency by Flask endpoint", ('endpoint',))
+render_seconds = Histogram(
+    'template_render_seconds', "Jinja render time by template", ('template',))
+
+METRICS = [upstream_requests, upstream_seconds, http_requests, http_seconds, render_seconds]
+
+
+def render_cache_metrics():
+    return [
+        "# HELP response_cache_requests_total Response cache lookups by result",
+        "# TYPE response_cache_requests_total counter",
+        f'response_cache_requests_total{{result="hit"}} {response_cache.hits}',
+        f'response_cache_requests_total{{result="stale"}} {response_cache.stale_hits}',
+        f'response_cache_requests_total{{result="miss"}} {response_cache.misses}',
+        "# HELP response_cache_bytes Approximate size of cached responses",
+        "# TYPE response_cache_bytes gauge",
+        f"response_cache_bytes {response_cache.total_bytes}",
+        "# HELP response_cache_entries Number of cached responses",
+        "# TYPE response_cache_entries gauge",
+        f"response_cache_entries {len(response_cache)}",
+    ]
+
+
+def render_all():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(render_cache_metrics())
+    return '\n'.join(lines) + '\n'
+
+
+def record_timing(phase, seconds):
+    """Add to this request's Server-Timing phase, if called inside a request."""
+    if has_app_context():
+        timings = g.setdefault('timings', {})
+        timings[phase] = timings.get(phase, 0) + seconds
+
+
+def observe_upstream(endpoint, outcome, seconds):
+    upstream_requests.inc(endpoint, outcome)
+    upstream_seconds.observe(seconds, endpoint)
+    record_timing('upstream', seconds)
+
+
+def init_app(app):
+    timing_header = os.environ.get('METRICS_TIMING_HEADER', '') not in ('', '0')
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        http_requests.inc(endpoint, str(response.status_code))
+        http_seconds.observe(elapsed, endpoint)
+        if timing_header:
+            timings = g.get('timings', {})
+            parts = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.items()]
+            parts.append(f"total;dur={elapsed * 1000:.1f}")
+            response.headers['Server-Timing'] = ', '.join(parts)
+        return response
+
+    def start_render(sender, template, context, **extra):
+        g.render_started = time.perf_counter()
+
+    def finish_render(sender, template, context, **extra):
+        started = g.pop('render_started', None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            render_seconds.observe(elapsed, template.name or 'string')
+            record_timing('render', elapsed)
+
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(finish_render, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_all(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'stored_at', 'ttl', 'stale_ttl')
+
+    def __init__(self, value, size, ttl, stale_ttl):
+        self.value = value
+        self.size = size
+        self.stored_at = time.time()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    def age(self):
+        return time.time() - self.stored_at
+
+    def is_fresh(self):
+        return self.age() < self.ttl
+
+    def is_usable(self):
+        return self.age() < self.ttl + self.stale_ttl
+
+
+class ResponseCache:
+    """LRU cache with per-entry TTL and stale-while-revalidate.
+
+    Fresh entries are returned as-is. Stale entries (past ttl but within
+    ttl + stale_ttl) are returned immediately while one background refresh
+    runs. Misses are loaded on the calling thread, and concurrent misses for
+    the same key wait on a single load. Entries are evicted least recently
+    used first once their total size passes max_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, refresh_workers=4):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='cache-refresh')
+
+    def get(self, key, loader, ttl, stale_ttl=0):
+        """Return the cached value for key, calling loader() -> (value, size) when needed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.is_fresh():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if entry is not None and entry.is_usable():
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._inflight[key] = threading.Event()
+                    self._refresh_pool.submit(self._refresh, key, loader, ttl, stale_ttl)
+                return entry.value
+            self.misses += 1
+
+        return self.load(key, loader, ttl, stale_ttl)
+
+    def load(self, key, loader, ttl, stale_ttl=0):
+        """Load key now, sharing the result with any concurrent load of the same key."""
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.is_usable():
+                    return entry.value
+            # The shared load failed; try ourselves so the caller sees the error
+            value, size = loader()
+            self.put(key, value, ttl, stale_ttl, size)
+            return value
+
+        try:
+            value, size = loader()
+            self.put(key, value, ttl, stale_ttl, size)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _refresh(self, key, loader, ttl, stale_ttl):
+        try:
+            value, size = loader()
+            self.put(key, value, ttl, stale_ttl, size)
+        except Exception as e:
+            print(f"Error refreshing cached {key}: {e}")
+        finally:
+            with self._lock:
+                event = self._inflight.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def put(self, key, value, ttl, stale_ttl=0, size=1):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.size
+            self._entries[key] = _Entry(value, size, ttl, stale_ttl)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+
+    def peek(self, key, include_expired=False):
+        """Cached value for key if it is still usable, without loading or refreshing.
+
+        include_expired=True also returns entries past their stale window that
+        have not been evicted yet, as a last resort when the upstream is down.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not (include_expired or entry.is_usable()):
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache(max_bytes=int(os.environ.get('RESPONSE_CACHE_MB', '64')) * 1024 * 1024)
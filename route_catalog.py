@@ -0,0 +1,84 @@
+import csv
+import threading
+import time
+
+import requests
+
+from transiter import fetch_json
+
+
+# Bullet images for route ids that aren't just their lowercased id
+ROUTE_ICONS = {
+    '5X': '5',
+    '6X': '6d',
+    '7X': '7d',
+    'FX': 'f',
+    'GS': 'gs',
+    'FS': 'fs',
+    'H': 'h',
+    'SI': 'sir',
+}
+
+
+def route_bullet(route_id):
+    """Image name (without .svg) of the bullet shown for a route id."""
+    return ROUTE_ICONS.get(route_id, route_id.lower())
+
+
+class RouteCatalog:
+    """Route short names, loaded once so name lookups never touch the network."""
+
+    def __init__(self):
+        self._short_names = {}
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def load_routes_txt(self, file_path='routes.txt'):
+        """Load route_id -> route_short_name from a GTFS routes.txt."""
+        short_names = {}
+        with open(file_path, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                short_names[row['route_id']] = row['route_short_name']
+        with self._lock:
+            self._short_names.update(short_names)
+        return len(short_names)
+
+    def refresh_from_transiter(self):
+        """Replace names with one bulk /routes fetch; keeps old names on failure."""
+        try:
+            data = fetch_json("/routes")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error refreshing route catalog: {e}")
+            return False
+
+        short_names = {route['id']: route.get('shortName', route['id'])
+                       for route in data.get('routes', []) if 'id' in route}
+        if not short_names:
+            return False
+        with self._lock:
+            self._short_names.update(short_names)
+        return True
+
+    def start_background_refresh(self, interval):
+        """Re-fetch /routes every `interval` seconds on a daemon thread."""
+        if self._refresh_thread is not None:
+            return
+
+        def refresh_loop():
+            while True:
+                time.sleep(interval)
+                self.refresh_from_transiter()
+
+        self._refresh_thread = threading.Thread(target=refresh_loop, name='route-catalog-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def short_name(self, route_id):
+        """Short name for route_id, or None if the route is unknown."""
+        return self._short_names.get(route_id)
+
+    def __len__(self):
+        return len(self._short_names)
+
+
+route_catalog = RouteCatalog()
@@ -0,0 +1,44 @@
+"""Where per-browser display settings are kept, chosen by SESSION_BACKEND.
+
+    cookie     - signed cookie (Flask's default); nothing stored server-side
+    memory     - in-process dict with TTL and size-based eviction
+    redis      - any Redis-compatible server at SESSION_REDIS_URL (redis
+                 package needed), for several workers sharing sessions
+    filesystem - the old flask_session/ directory
+
+Only cookie and memory keep session reads off the disk and the network.
+"""
+import os
+from datetime import timedelta
+
+from flask_session import Session
+
+
+SESSION_BACKENDS = ('cookie', 'memory', 'redis', 'filesystem')
+
+
+def init_session(app):
+    backend = os.environ.get('SESSION_BACKEND', 'cookie')
+    ttl = int(os.environ.get('SESSION_TTL_SECONDS', str(30 * 24 * 3600)))
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=ttl)
+    app.config['SESSION_PERMANENT'] = False
+
+    if backend == 'cookie':
+        return
+    if backend == 'memory':
+        from cachelib import SimpleCache
+        app.config['SESSION_TYPE'] = 'cachelib'
+        app.config['SESSION_CACHELIB'] = SimpleCache(
+            threshold=int(os.environ.get('SESSION_MAX_ENTRIES', '10000')),
+            default_timeout=ttl
+        )
+    elif backend == 'redis':
+        import redis
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.Redis.from_url(
+            os.environ.get('SESSION_REDIS_URL', 'redis://127.0.0.1:6379/0'))
+    elif backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+    else:
+        raise ValueError(f"SESSION_BACKEND must be one of {', '.join(SESSION_BACKENDS)}, not {backend!r}")
+    Session(app)
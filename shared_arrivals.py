@@ -0,0 +1,164 @@
+"""System-wide arrivals shared between processes through a memory-mapped file.
+
+With several web workers, every in-process arrivals source would poll
+upstream once per worker. Instead one fetcher process (run this module)
+refreshes the GTFS-RT FeedIndex and publishes its ArrivalsTable to
+SHARED_ARRIVALS_PATH, and each worker (ARRIVALS_BACKEND=shm) maps that
+file read-only. Upstream load and table memory stay the same however many
+workers there are.
+
+Layout, all native byte order:
+
+    header       HEADER struct (magic, layout version, generation,
+                 updated_at, rows, strings and offsets blob lengths)
+    columns      departures, routes, destinations, trips: rows int32 each
+    strings      JSON list of the interned route, destination and trip ids
+    offsets      JSON {stop_id: [start, end]}
+
+Each generation is written to a temporary file and renamed over the path,
+so readers never see a half-written table and never take a lock: a reader
+that still holds the previous mapping keeps using it until it next checks
+the path. The columns are used straight out of the mapping; only the
+small strings and offsets blobs are decoded, once per generation.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+from arrivals_table import ArrivalsTable, ArrivalsTableSource
+
+
+MAGIC = b'NYAR'
+# Bump when the layout changes; readers refuse files from another layout
+LAYOUT_VERSION = 1
+HEADER = struct.Struct('=4sIQdIII4x')
+COLUMNS = ('departures', 'routes', 'destinations', 'trips')
+ITEM_SIZE = array('i').itemsize
+
+
+def shared_arrivals_path():
+    """SHARED_ARRIVALS_PATH, defaulting to a file on /dev/shm where there is one."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.environ.get('SHARED_ARRIVALS_PATH', os.path.join(directory, 'nyct-arrivals'))
+
+
+def write_table(path, table, generation, updated_at):
+    """Publish an ArrivalsTable at path, replacing the previous generation atomically."""
+    strings = json.dumps(table.strings).encode('utf-8')
+    offsets = json.dumps(table.offsets).encode('utf-8')
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, LAYOUT_VERSION, generation, updated_at, len(table), len(strings), len(offsets)))
+        for name in COLUMNS:
+            getattr(table, name).tofile(f)
+        f.write(strings)
+        f.write(offsets)
+    os.replace(temp_path, path)
+
+
+def read_table(buffer):
+    """(ArrivalsTable, generation, updated_at) over a mapped file; the columns are views into it."""
+    magic, layout, generation, updated_at, rows, strings_size, offsets_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC or layout != LAYOUT_VERSION:
+        raise ValueError(f"not a layout {LAYOUT_VERSION} shared arrivals file")
+    view = memoryview(buffer)
+    position = HEADER.size
+    columns = []
+    for _ in COLUMNS:
+        columns.append(view[position:position + rows * ITEM_SIZE].cast('i'))
+        position += rows * ITEM_SIZE
+    strings = json.loads(bytes(view[position:position + strings_size]))
+    position += strings_size
+    offsets = json.loads(bytes(view[position:position + offsets_size]))
+    return ArrivalsTable(strings, offsets, *columns), generation, updated_at
+
+
+class SharedArrivalsReader(ArrivalsTableSource):
+    """Arrivals source for web workers, backed by the fetcher's shared file.
+
+    A daemon thread checks the path every `interval` seconds and maps a new
+    generation whenever the file has been replaced.
+    """
+
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = interval
+        self.table = ArrivalsTable.from_rows(())
+        self.generation = None
+        self.updated_at = None
+        self._identity = None
+        self.version = 0
+        self._updated = threading.Condition()
+        # Called after each new generation with {platform_id: snapshot} for every platform
+        self.listeners = []
+        self._thread = None
+
+    def refresh(self):
+        """Map the file if it was replaced since the last check; returns True if it was."""
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                identity = (stat.st_ino, stat.st_mtime_ns)
+                if identity == self._identity:
+                    return False
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            table, generation, updated_at = read_table(buffer)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error reading shared arrivals {self.path}: {e}")
+            return False
+
+        # A replaced file is always a new table: generations restart at 1
+        # when the fetcher restarts, so they can't be compared across files
+        self._identity = identity
+        self.generation = generation
+        self.updated_at = updated_at
+        self._swap_table(table)
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if not self.refresh() and self.generation is None:
+            print(f"No shared arrivals at {self.path} yet; is the fetcher running?")
+
+        def check_loop():
+            while True:
+                time.sleep(self.interval)
+                self.refresh()
+
+        self._thread = threading.Thread(target=check_loop, name='shared-arrivals', daemon=True)
+        self._thread.start()
+
+
+def run_fetcher(path, interval):
+    """Refresh the GTFS-RT feeds every `interval` seconds and publish each table at path."""
+    from arrival_history import arrival_history_from_env
+    from gtfs_realtime import FeedIndex, feed_source_from_env
+
+    feed_index = FeedIndex(feed_source_from_env(), interval=0)
+    # The fetcher is the only process that sees every refresh, so it keeps the history
+    arrival_history = arrival_history_from_env()
+    if arrival_history is not None:
+        arrival_history.start()
+        feed_index.listeners.append(arrival_history.record_snapshots)
+
+    print(f"Publishing arrivals to {path} every {interval}s")
+    while True:
+        started = time.time()
+        try:
+            feed_index.refresh()
+            write_table(path, feed_index.table, feed_index.version, feed_index.updated_at)
+        except Exception as e:
+            print(f"Error publishing shared arrivals {path}: {e}")
+        time.sleep(max(0, interval - (time.time() - started)))
+
+
+if __name__ == '__main__':
+    run_fetcher(shared_arrivals_path(), int(os.environ.get('GTFS_RT_REFRESH_SECONDS', '30')))
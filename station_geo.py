@@ -0,0 +1,116 @@
+import heapq
+import math
+import threading
+
+from stop_index import get_stop_index
+
+
+EARTH_RADIUS_M = 6371000
+# ~1.1 km north-south; around 0.85 km east-west at New York's latitude
+CELL_DEGREES = 0.01
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class StationGrid:
+    """Parent stations bucketed into a fixed lat/lon grid.
+
+    A nearest-k query scans rings of cells outward from the query point and
+    stops once the k-th best distance is closer than anything the next ring
+    could hold, so it touches a handful of cells instead of every station.
+    Rings never reach past the stations' bounding box; a point outside it
+    is answered with one linear pass instead.
+    """
+
+    def __init__(self, stop_index):
+        self.version = stop_index.version
+        self.cells = {}
+        self.stations = [stop_index.stops[stop_id] for stop_id in stop_index.parents]
+        for stop in self.stations:
+            self.cells.setdefault(self._cell(stop.stop_lat, stop.stop_lon), []).append(stop)
+        rows = [row for row, _ in self.cells] or [0]
+        cols = [col for _, col in self.cells] or [0]
+        self.bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    @staticmethod
+    def _cell(lat, lon):
+        return math.floor(lat / CELL_DEGREES), math.floor(lon / CELL_DEGREES)
+
+    def _ring(self, row, col, radius):
+        """Cells `radius` steps from (row, col) that lie inside the bounding box."""
+        min_row, max_row, min_col, max_col = self.bounds
+        if radius == 0:
+            yield row, col
+            return
+        cols = range(max(col - radius, min_col), min(col + radius, max_col) + 1)
+        for r in (row - radius, row + radius):
+            if min_row <= r <= max_row:
+                for c in cols:
+                    yield r, c
+        for r in range(max(row - radius + 1, min_row), min(row + radius, max_row + 1)):
+            for c in (col - radius, col + radius):
+                if min_col <= c <= max_col:
+                    yield r, c
+
+    @staticmethod
+    def _consider(best, lat, lon, stops, k, max_distance_m):
+        """Push stops into the max-heap `best` of (-distance, stop_id, stop), keeping the k closest."""
+        for stop in stops:
+            distance = haversine_m(lat, lon, stop.stop_lat, stop.stop_lon)
+            if max_distance_m is not None and distance > max_distance_m:
+                continue
+            entry = (-distance, stop.stop_id, stop)
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+
+    def nearest(self, lat, lon, k=5, max_distance_m=None):
+        """Up to k (distance_m, Stop) pairs, closest first."""
+        row, col = self._cell(lat, lon)
+        min_row, max_row, min_col, max_col = self.bounds
+        if not (min_row <= row <= max_row and min_col <= col <= max_col):
+            # Far from every station: ring scans would cross mostly empty cells
+            best = []
+            self._consider(best, lat, lon, self.stations, k, max_distance_m)
+            return self._sorted(best)
+
+        # Narrowest cell side, so `radius` rings out is at least this far away
+        cell_m = CELL_DEGREES * math.pi / 180 * EARTH_RADIUS_M * math.cos(math.radians(min(abs(lat), 89)))
+        max_radius = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+
+        best = []
+        for radius in range(max_radius + 1):
+            for cell in self._ring(row, col, radius):
+                self._consider(best, lat, lon, self.cells.get(cell, ()), k, max_distance_m)
+            reach = radius * cell_m
+            if len(best) == k and -best[0][0] <= reach:
+                break
+            if max_distance_m is not None and reach > max_distance_m:
+                break
+        return self._sorted(best)
+
+    @staticmethod
+    def _sorted(best):
+        return [(distance, stop) for distance, _, stop in sorted((-d, stop_id, stop) for d, stop_id, stop in best)]
+
+
+_grid = None
+_grid_lock = threading.Lock()
+
+
+def get_station_grid(file_path='stops.txt'):
+    """Shared StationGrid, rebuilt when stops.txt changes."""
+    global _grid
+    stop_index = get_stop_index(file_path)
+    if _grid is None or _grid.version != stop_index.version:
+        with _grid_lock:
+            if _grid is None or _grid.version != stop_index.version:
+                _grid = StationGrid(stop_index)
+    return _grid
@@ -0,0 +1,105 @@
+import re
+import threading
+import unicodedata
+
+from stop_index import get_stop_index
+from topology import get_topology
+
+
+def normalize(text):
+    """Lowercase, strip accents and turn punctuation into spaces: "Av-Bway" -> "av bway"."""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text.lower()).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StationSearch:
+    """Autocomplete over parent station names.
+
+    Every prefix of every word in a name maps to the stations containing it
+    (a trie flattened into a dict), so a query is one lookup per word and a
+    set intersection. When prefixes find too little, a trigram index ranks
+    names by overlap with the query, which tolerates typos and missing
+    letters.
+    """
+
+    def __init__(self, stop_index, topology):
+        self.version = (stop_index.version, topology.version)
+        stations = sorted(
+            (stop_index.stops[stop_id] for stop_id in stop_index.parents),
+            key=lambda stop: (stop.stop_name, stop.stop_id)
+        )
+        self.stations = [
+            (stop.stop_id, stop.stop_name, topology.routes_for_stop(stop.stop_id))
+            for stop in stations
+        ]
+        self.names = [normalize(stop.stop_name) for stop in stations]
+        self.prefixes = {}
+        self.grams = {}
+        self.gram_counts = []
+        for i, name in enumerate(self.names):
+            for word in set(name.split()):
+                for end in range(1, len(word) + 1):
+                    self.prefixes.setdefault(word[:end], set()).add(i)
+            name_grams = trigrams(name)
+            self.gram_counts.append(len(name_grams))
+            for gram in name_grams:
+                self.grams.setdefault(gram, []).append(i)
+
+    def _result(self, i, match):
+        stop_id, stop_name, routes = self.stations[i]
+        return {'stop_id': stop_id, 'stop_name': stop_name, 'routes': routes, 'match': match}
+
+    def search(self, query, limit=10, min_similarity=0.3):
+        """Best stations for query: prefix matches first, then fuzzy ones."""
+        query = normalize(query)
+        if not query:
+            return []
+
+        matches = None
+        for word in query.split():
+            found = self.prefixes.get(word, set())
+            matches = found if matches is None else matches & found
+            if not matches:
+                break
+        # Exact names, then names starting with the query, then alphabetical
+        ranked = sorted(matches or (), key=lambda i: (self.names[i] != query, not self.names[i].startswith(query), i))
+        results = [self._result(i, 'prefix') for i in ranked[:limit]]
+        if len(results) >= limit:
+            return results
+
+        query_grams = trigrams(query)
+        shared = {}
+        for gram in query_grams:
+            for i in self.grams.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+        scored = []
+        for i, count in shared.items():
+            if matches and i in matches:
+                continue
+            # Dice coefficient of the two trigram sets
+            similarity = 2 * count / (len(query_grams) + self.gram_counts[i])
+            if similarity >= min_similarity:
+                scored.append((-similarity, i))
+        scored.sort()
+        results.extend(self._result(i, 'fuzzy') for _, i in scored[:limit - len(results)])
+        return results
+
+
+_search = None
+_search_lock = threading.Lock()
+
+
+def get_station_search(file_path='stops.txt'):
+    """Shared StationSearch, rebuilt when stops.txt or the topology changes."""
+    global _search
+    version = (get_stop_index(file_path).version, get_topology().version)
+    if _search is None or _search.version != version:
+        with _search_lock:
+            if _search is None or _search.version != version:
+                _search = StationSearch(get_stop_index(file_path), get_topology())
+    return _search
@@ -0,0 +1,91 @@
+import csv
+import os
+import threading
+from collections import namedtuple
+
+
+Stop = namedtuple('Stop', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station'])
+
+
+class StopIndex:
+    """stops.txt held in memory, reloaded only when the file's mtime changes."""
+
+    def __init__(self, file_path='stops.txt'):
+        self.file_path = file_path
+        self.mtime = None
+        self.version = 0
+        self.stops = {}
+        self.parents = []
+        self.children = {}
+        self.stops_by_service = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.file_path)
+        stops = {}
+        parents = []
+        children = {}
+        stops_by_service = {}
+
+        with open(self.file_path, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                stop = Stop(
+                    stop_id=row['stop_id'],
+                    stop_name=row['stop_name'],
+                    stop_lat=float(row['stop_lat']),
+                    stop_lon=float(row['stop_lon']),
+                    parent_station=row.get('parent_station') or None
+                )
+                stops[stop.stop_id] = stop
+                if stop.parent_station:
+                    children.setdefault(stop.parent_station, []).append(stop.stop_id)
+                else:
+                    parents.append(stop.stop_id)
+                    # Trunk membership follows the service letter the stop id starts with
+                    stops_by_service.setdefault(stop.stop_id[0], []).append(stop.stop_id)
+
+        # Swap everything in at once so readers never see a half-built index
+        self.stops = stops
+        self.parents = parents
+        self.children = children
+        self.stops_by_service = stops_by_service
+        self.mtime = mtime
+        self.version += 1
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.file_path)
+        except OSError as e:
+            print(f"Error checking {self.file_path}: {e}")
+            return False
+        if mtime == self.mtime:
+            return False
+        with self._lock:
+            if mtime != self.mtime:
+                self.load()
+        return True
+
+    def get(self, stop_id):
+        return self.stops.get(stop_id)
+
+    def __contains__(self, stop_id):
+        return stop_id in self.stops
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_stop_index(file_path='stops.txt'):
+    """Shared StopIndex for file_path, refreshed if the file changed on disk."""
+    index = _indexes.get(file_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(file_path)
+            if index is None:
+                index = _indexes[file_path] = StopIndex(file_path)
+                return index
+    index.reload_if_changed()
+    return index
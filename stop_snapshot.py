@@ -0,0 +1,193 @@
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from dataclasses import dataclass, field
+from operator import attrgetter
+
+import requests
+from flask import g, has_app_context
+
+from metrics import record_timing
+from response_cache import response_cache
+from transiter import UPSTREAM_TIMEOUT, clean_stop_id, fetch_json
+
+
+# Shared pool for fanning out independent stop fetches (parent + N/S platforms)
+_fetch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='stop-fetch')
+
+# Names, transfers and the stop's route change rarely, so the last good
+# snapshot of each stop is kept this long for the helpers that only need those
+STOP_METADATA_TTL = 6 * 3600
+
+
+@dataclass
+class StopTime:
+    trip_id: str
+    route_id: str
+    destination: str
+    headsign: str
+    departure_time: float = None
+
+
+_departure_time = attrgetter('departure_time')
+
+
+@dataclass
+class Transfer:
+    from_stop_id: str
+    from_stop_name: str
+    to_stop_id: str
+    to_stop_name: str
+    transfer_type: str = None
+    min_transfer_time: int = 0
+
+
+@dataclass
+class StopSnapshot:
+    """One parsed Transiter stop response, shared by every helper in a request.
+
+    stop_times only holds entries with a departure time, sorted by it.
+    """
+    stop_id: str
+    name: str
+    route_id: str = "Unknown"
+    stop_times: list = field(default_factory=list)
+    transfers: list = field(default_factory=list)
+    headways: list = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, stop_id, data):
+        stop_times = []
+        for stop_time in data.get("stopTimes", []):
+            trip = stop_time.get("trip", {})
+            departure_time = stop_time.get("departure", {}).get("time")
+            if departure_time is None:
+                continue
+            stop_times.append(StopTime(
+                trip_id=trip.get("id", "Unknown"),
+                route_id=trip.get("route", {}).get("id", "Unknown"),
+                destination=trip.get("destination", {}).get("name", "Unknown"),
+                headsign=stop_time.get("headsign", "Unknown"),
+                departure_time=float(departure_time)
+            ))
+        stop_times.sort(key=_departure_time)
+
+        transfers = []
+        for transfer in data.get("transfers", []):
+            transfers.append(Transfer(
+                from_stop_id=clean_stop_id(transfer['fromStop']['id']),
+                from_stop_name=transfer['fromStop']['name'],
+                to_stop_id=clean_stop_id(transfer['toStop']['id']),
+                to_stop_name=transfer['toStop']['name'],
+                transfer_type=transfer.get('type'),
+                min_transfer_time=transfer.get('minTransferTime', 0)
+            ))
+
+        headways = []
+        for route in data.get("data", []):
+            if 'headways' in route:
+                headways.append({
+                    'route_id': route['route']['id'],
+                    'scheduled': route['headways'].get('scheduled'),
+                    'observed': route['headways'].get('observed')
+                })
+
+        return cls(
+            stop_id=stop_id,
+            name=data.get("name", "Unknown Station"),
+            route_id=data.get("route", {}).get("id", "Unknown"),
+            stop_times=stop_times,
+            transfers=transfers,
+            headways=headways
+        )
+
+    def upcoming(self, after):
+        """stop_times departing after `after`, found by bisecting the sorted list."""
+        return self.stop_times[bisect_right(self.stop_times, after, key=_departure_time):]
+
+
+def fetch_stop_snapshot(stop_id, timeout=UPSTREAM_TIMEOUT, fresh=False):
+    """Fetch and parse a stop from Transiter, or None if the call fails."""
+    try:
+        data = fetch_json(f"/stops/{stop_id}", timeout=timeout, fresh=fresh)
+        snapshot = StopSnapshot.from_json(stop_id, data)
+        response_cache.put(f"stop-metadata:{stop_id}", snapshot, STOP_METADATA_TTL)
+        return snapshot
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        print(f"Error fetching stop {stop_id}: {e}")
+        return None
+
+
+def fetch_stop_snapshots(stop_ids, timeout=UPSTREAM_TIMEOUT, fresh=False):
+    """Fetch several stops in parallel, returning {stop_id: snapshot or None}.
+
+    Page latency becomes the slowest single call rather than the sum. Stops
+    that have not answered within `timeout` seconds are reported as None.
+    """
+    stop_ids = list(dict.fromkeys(stop_ids))
+    if len(stop_ids) == 1:
+        return {stop_ids[0]: fetch_stop_snapshot(stop_ids[0], timeout, fresh)}
+
+    snapshots = dict.fromkeys(stop_ids)
+    started = time.perf_counter()
+    futures = {_fetch_pool.submit(fetch_stop_snapshot, stop_id, timeout, fresh): stop_id for stop_id in stop_ids}
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            snapshots[futures[future]] = future.result()
+    except TimeoutError:
+        late = [stop_id for future, stop_id in futures.items() if not future.done()]
+        print(f"Timed out fetching stops {', '.join(late)}")
+    # Pool threads have no app context to record into, so the request's
+    # upstream phase is the wall time spent waiting on the fan-out
+    record_timing('upstream', time.perf_counter() - started)
+    return snapshots
+
+
+# Where request-path snapshots come from; app.py points this at the arrivals poller
+_snapshot_source = fetch_stop_snapshots
+
+
+def set_snapshot_source(source):
+    """Serve snapshots from source(stop_ids) -> {stop_id: snapshot or None}."""
+    global _snapshot_source
+    _snapshot_source = source
+
+
+def get_stop_snapshots(stop_ids):
+    """Return snapshots for stop_ids, fetching each at most once per request.
+
+    Missing stops are requested from the snapshot source together, so the
+    parent and platform fetches run concurrently. Failed fetches are
+    remembered too, so a down upstream is hit once per request rather than
+    once per helper.
+    """
+    stop_ids = [clean_stop_id(stop_id) for stop_id in stop_ids]
+    if not has_app_context():
+        return _snapshot_source(stop_ids)
+
+    snapshots = g.setdefault('stop_snapshots', {})
+    missing = [stop_id for stop_id in stop_ids if stop_id not in snapshots]
+    if missing:
+        started = time.perf_counter()
+        snapshots.update(_snapshot_source(missing))
+        record_timing('snapshots', time.perf_counter() - started)
+    return {stop_id: snapshots[stop_id] for stop_id in stop_ids}
+
+
+def get_stop_snapshot(stop_id):
+    """Return the snapshot for stop_id, or None if it could not be fetched."""
+    return get_stop_snapshots([stop_id])[clean_stop_id(stop_id)]
+
+
+def get_stop_metadata(stop_id):
+    """Snapshot for reading a stop's name, transfers or route.
+
+    Served from the long-lived metadata cache when possible, so these
+    helpers keep working between realtime refreshes and while Transiter is
+    unreachable. Its stop_times may be old; use get_stop_snapshot for those.
+    """
+    stop_id = clean_stop_id(stop_id)
+    snapshot = response_cache.peek(f"stop-metadata:{stop_id}")
+    if snapshot is not None:
+        return snapshot
+    return get_stop_snapshot(stop_id)
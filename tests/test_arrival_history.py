@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from arrival_history import SYSTEM_TIMEZONE, ArrivalHistory
+from stop_snapshot import StopSnapshot, StopTime
+
+
+def at(hour, minute, day=18):
+    return datetime(2026, 10, day, hour, minute, tzinfo=SYSTEM_TIMEZONE).timestamp()
+
+
+def snapshot(*trains):
+    return StopSnapshot('A27S', '42 St-Port Authority Bus Terminal', stop_times=[
+        StopTime(trip_id, route_id, 'A55', 'Downtown', departure) for trip_id, route_id, departure in trains
+    ])
+
+
+def test_only_trains_that_left_are_departures(tmp_path):
+    history = ArrivalHistory(str(tmp_path))
+    now = at(8, 0)
+    history.departures('A27S', snapshot(('a1', 'A', now + 30), ('c1', 'C', now + 600), ('e1', 'E', now + 900)).stop_times, now)
+
+    # a1 left on time; c1 vanished ten minutes early (cancelled); e1 is still coming
+    later = now + 60
+    rows = history.departures('A27S', snapshot(('e1', 'E', now + 900)).stop_times, later)
+    assert rows == [('A27S', 'a1', 'A', int(now + 30))]
+
+
+def test_departure_is_filed_under_the_day_it_left(tmp_path):
+    history = ArrivalHistory(str(tmp_path))
+    before_midnight = at(23, 59)
+    history.departures('A27S', snapshot(('a1', 'A', before_midnight + 120)).stop_times, before_midnight)
+    # Predicted after midnight, but gone by 23:59:40
+    rows = history.departures('A27S', [], before_midnight + 40)
+    history.write(rows)
+
+    assert [row[1] for row in rows] == ['a1']
+    assert sorted(path.name for path in tmp_path.glob('*.sqlite')) == ['arrivals-2026-10-18.sqlite']
+    assert [row['trip_id'] for row in history.query('A27S', at(23, 0), at(1, 0, day=19))] == ['a1']
+
+
+def test_observation_gap_records_nothing(tmp_path):
+    history = ArrivalHistory(str(tmp_path))
+    now = at(8, 0)
+    history.departures('A27S', snapshot(('a1', 'A', now + 30)).stop_times, now)
+    assert history.departures('A27S', [], now + 600) == []
+
+
+def test_writers_sharing_a_day_file_agree_on_ids(tmp_path):
+    first = ArrivalHistory(str(tmp_path))
+    second = ArrivalHistory(str(tmp_path))
+    departed = at(8, 0)
+    first.write([('A27S', 'a1', 'A', departed)])
+    second.write([('A27N', 'c1', 'C', departed + 60), ('A27S', 'e1', 'E', departed + 120)])
+    first.write([('A27N', 'a2', 'A', departed + 180)])
+
+    rows = first.query('A27', departed - 60, departed + 600)
+    assert [(row['stop_id'], row['route_id'], row['trip_id']) for row in rows] == [
+        ('A27S', 'A', 'a1'), ('A27N', 'C', 'c1'), ('A27S', 'E', 'e1'), ('A27N', 'A', 'a2')
+    ]
@@ -0,0 +1,44 @@
+from headway_engine import DEPARTURE_GRACE, MAX_OBSERVATION_GAP, HeadwayEngine
+from stop_snapshot import StopTime
+
+
+def trains(*departures):
+    return [StopTime(trip_id, 'A', 'A55', 'Downtown', departure) for trip_id, departure in departures]
+
+
+def series(engine):
+    return engine._series['A27'][('A', 'S')]
+
+
+def test_headway_between_observed_departures():
+    engine = HeadwayEngine()
+    engine.observe('A27S', trains(('a1', 1000), ('a2', 1300)), now=990)
+    for now in range(1020, 1300, 60):
+        engine.observe('A27S', trains(('a2', 1300)), now=now)
+    engine.observe('A27S', trains(), now=1310)
+
+    assert series(engine).headways[:series(engine).count].tolist() == [300.0]
+    assert engine.stats_for_station('A27', now=1320)[0]['mean'] == 300
+
+
+def test_early_disappearance_is_not_a_departure():
+    engine = HeadwayEngine()
+    engine.observe('A27S', trains(('a1', 1000), ('a2', 1000 + DEPARTURE_GRACE + 600)), now=990)
+    engine.observe('A27S', trains(('a1', 1000)), now=1020)
+    assert 'A27' not in engine._series
+
+
+def test_no_headway_across_an_observation_gap():
+    engine = HeadwayEngine()
+    engine.observe('A27S', trains(('a1', 1000), ('a2', 1300)), now=990)
+    engine.observe('A27S', trains(('a2', 1300)), now=1020)
+    assert series(engine).last_departure == 1000
+
+    # Nothing observed for longer than the gap: a2 and any trains after it
+    # may have left unseen, so the next departure starts a new series
+    resumed = 1020 + MAX_OBSERVATION_GAP + 600
+    engine.observe('A27S', trains(('a5', resumed + 30)), now=resumed)
+    assert series(engine).last_departure is None
+    engine.observe('A27S', trains(('a6', resumed + 330)), now=resumed + 40)
+    assert series(engine).count == 0
+    assert series(engine).last_departure == resumed + 30
@@ -0,0 +1,65 @@
+from journey_planner import first_gap, get_timetable, platform_directions
+from stop_index import get_stop_index
+
+
+def rides(journey):
+    return [(leg['service'], leg['from_stop_id'], leg['to_stop_id']) for leg in journey if leg['type'] == 'ride']
+
+
+def line_stations():
+    stations = {}
+    for stop_id in sorted(get_stop_index('stops.txt').parents):
+        stations.setdefault(stop_id[0], []).append(stop_id)
+    return stations
+
+
+def test_first_gap_allows_local_express_and_line_change_runs():
+    stop_index = get_stop_index('stops.txt')
+    assert first_gap(['A24', 'A25', 'A27'], stop_index, line_stations()) is None
+    assert first_gap(['A15', 'A24'], stop_index, line_stations()) is None
+    assert first_gap(['G21', 'F09', 'F11'], stop_index, line_stations()) is None
+
+
+def test_first_gap_finds_placeholder_runs():
+    stop_index = get_stop_index('stops.txt')
+    assert first_gap(['101', '127', '103'], stop_index, line_stations()) == ('101', '127')
+    assert first_gap(['501', '502', '247'], stop_index, line_stations()) == ('502', '247')
+
+
+def test_placeholder_services_are_not_routable():
+    timetable = get_timetable()
+    assert '1' not in timetable.pattern_service
+    for stop_id in ('101', '103', '127'):
+        assert not timetable.serves(stop_id)
+    assert timetable.plan('101', '127', 8 * 3600) == []
+    assert timetable.plan('101', '103', 8 * 3600) == []
+
+
+def test_plan_rides_one_service():
+    journeys = get_timetable().plan('A27', 'A24', 8 * 3600)
+    assert [rides(journey) for journey in journeys] == [[('A', 'A27', 'A24')]]
+    leg = journeys[0][0]
+    assert leg['direction'] == 'N'
+    assert 8 * 3600 <= leg['depart'] < leg['arrive'] < 8 * 3600 + 1800
+
+
+def test_plan_changes_trains_and_arrives_after_each_ride():
+    journeys = get_timetable().plan('A27', 'M16', 8 * 3600)
+    assert journeys
+    journey = journeys[0]
+    assert rides(journey)[-1][0] == 'M'
+    ready = 8 * 3600
+    for leg in journey:
+        if leg['type'] == 'ride':
+            assert leg['depart'] >= ready
+            ready = leg['arrive']
+
+
+def test_shuttle_links_times_square_and_grand_central():
+    journeys = get_timetable().plan('902', '901', 8 * 3600)
+    assert rides(journeys[0]) == [('GS', '902', '901')]
+
+
+def test_platform_directions_follow_stop_ids_per_line():
+    assert platform_directions(['A24', 'A25', 'A27']) == ['S', 'S', 'S']
+    assert platform_directions(['D20', 'D21', 'M18', 'M16']) == ['S', 'S', 'N', 'N']
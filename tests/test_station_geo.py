@@ -0,0 +1,44 @@
+import time
+
+from station_geo import StationGrid, haversine_m
+from stop_index import get_stop_index
+
+
+def brute_force(lat, lon, k):
+    stop_index = get_stop_index('stops.txt')
+    stops = [stop_index.stops[stop_id] for stop_id in stop_index.parents]
+    return sorted((haversine_m(lat, lon, stop.stop_lat, stop.stop_lon), stop.stop_id) for stop in stops)[:k]
+
+
+def ids(results):
+    return [stop.stop_id for _, stop in results]
+
+
+def test_nearest_inside_area_matches_brute_force():
+    grid = StationGrid(get_stop_index('stops.txt'))
+    for lat, lon in [(40.7527, -73.9772), (40.6782, -73.9442), (40.5800, -74.1502), (40.8270, -73.9260)]:
+        expected = brute_force(lat, lon, 5)
+        results = grid.nearest(lat, lon, k=5)
+        assert ids(results) == [stop_id for _, stop_id in expected]
+        assert [round(distance) for distance, _ in results] == [round(distance) for distance, _ in expected]
+
+
+def test_nearest_respects_max_distance():
+    grid = StationGrid(get_stop_index('stops.txt'))
+    results = grid.nearest(40.7527, -73.9772, k=20, max_distance_m=400)
+    assert results
+    assert all(distance <= 400 for distance, _ in results)
+
+
+def test_nearest_outside_area_is_fast_and_correct():
+    grid = StationGrid(get_stop_index('stops.txt'))
+    for lat, lon in [(0, 0), (38.9, -77.0), (-45, 170)]:
+        started = time.perf_counter()
+        results = grid.nearest(lat, lon, k=3)
+        assert time.perf_counter() - started < 0.1
+        assert ids(results) == [stop_id for _, stop_id in brute_force(lat, lon, 3)]
+
+
+def test_nearest_outside_area_with_radius_finds_nothing():
+    grid = StationGrid(get_stop_index('stops.txt'))
+    assert grid.nearest(0, 0, k=5, max_distance_m=5000) == []
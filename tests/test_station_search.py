@@ -0,0 +1,34 @@
+from station_search import get_station_search, normalize
+
+
+def names(results):
+    return [result['stop_name'] for result in results]
+
+
+def test_normalize_folds_case_accents_and_punctuation():
+    assert normalize("Av-Bway ") == "av bway"
+    assert normalize("Café 42nd") == "cafe 42nd"
+
+
+def test_exact_name_ranks_before_other_prefix_matches():
+    results = get_station_search().search('bedford av')
+    assert results[0]['stop_name'] == 'Bedford Av'
+    assert results[0]['match'] == 'prefix'
+
+
+def test_names_starting_with_the_query_rank_first():
+    results = get_station_search().search('42 st')
+    assert names(results)[:2] == ['42 St-Bryant Pk', '42 St-Port Authority Bus Terminal']
+    assert 'Grand Central-42 St' in names(results)
+
+
+def test_typos_fall_back_to_fuzzy_matches():
+    results = get_station_search().search('grand cntral', limit=3)
+    assert names(results) == ['Grand Central-42 St'] * 3
+    assert {result['match'] for result in results} == {'fuzzy'}
+    assert results[0]['routes']
+
+
+def test_no_matches():
+    assert get_station_search().search('xyzzy') == []
+    assert get_station_search().search('  ') == []
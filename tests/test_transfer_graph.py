@@ -0,0 +1,15 @@
+from transfer_graph import get_transfer_graph
+
+
+def routes_to(stop_id):
+    return {transfer['to_stop_id']: transfer['to_route'] for transfer in get_transfer_graph().transfers_for(stop_id)}
+
+
+def test_shuttle_platforms_use_the_shuttle_bullet():
+    graph = get_transfer_graph()
+    assert {transfer['from_route'] for transfer in graph.transfers_for('901')} == {'gs'}
+    assert routes_to('127')['902'] == 'gs'
+
+
+def test_route_icons_come_from_the_station_services():
+    assert routes_to('902') == {'127': '1', '725': '7', 'A27': 'a', 'R16': 'r'}
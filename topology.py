@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+from stop_index import get_stop_index
+
+
+# Trunk lines and the services that run on them
+TRUNK_LINES = {
+    'Eighth Avenue Line': ['A', 'C', 'E'],
+    'Sixth Avenue Line': ['B', 'D', 'F', 'M'],
+    'Crosstown Line': ['G'],
+    'Canarsie Line': ['L'],
+    'Nassau Street Line': ['J', 'Z'],
+    'Broadway Line': ['N', 'Q', 'R', 'W'],
+    'Broadway–Seventh Avenue Line': ['1', '2', '3'],
+    'Lexington Avenue Line': ['4', '5', '6'],
+    'Flushing Line': ['7'],
+    'Second Avenue Line': ['T'],
+    '42nd Street Shuttle': ['GS'],
+    'Franklin Avenue Shuttle': ['FS'],
+    'Rockaway Park Shuttle': ['H'],
+    'Staten Island Railway': ['SIR'],
+}
+
+TRUNK_LINE_COLORS = {
+    'Eighth Avenue Line': '#0039a6',      # Blue
+    'Sixth Avenue Line': '#ff6319',       # Orange
+    'Crosstown Line': '#6cbe45',          # Lime
+    'Canarsie Line': '#a7a9ac',           # Light slate gray
+    'Nassau Street Line': '#996633',      # Brown
+    'Broadway Line': '#fccc0a',           # Yellow
+    'Broadway–Seventh Avenue Line': '#ee352e',  # Red
+    'Lexington Avenue Line': '#00933c',   # Green
+    'Flushing Line': '#b933ad',           # Purple
+    'Second Avenue Line': '#00add0',      # Turquoise
+    '42nd Street Shuttle': '#808183',     # Dark slate gray
+    'Franklin Avenue Shuttle': '#808183', # Dark slate gray
+    'Rockaway Park Shuttle': '#808183',   # Dark slate gray
+    'Shuttles': '#808183',                # Dark slate gray
+    'Staten Island Railway': '#0078c6',
+}
+
+
+class Topology:
+    """trunk_line_stops.json plus the trunk dicts, with reverse indexes.
+
+    Every stop id in the JSON must exist in stops.txt; load() raises
+    ValueError otherwise so bad data is caught before serving.
+    """
+
+    def __init__(self, file_path='trunk_line_stops.json', stops_path='stops.txt'):
+        self.file_path = file_path
+        self.stops_path = stops_path
+        self.mtime = None
+        self.stop_index_version = None
+        self.version = 0
+        self.trunk_line_stops = {}
+        self.service_to_trunk = {}
+        self.service_stops = {}
+        self.stop_services = {}
+        self.stop_trunks = {}
+        self.stop_routes = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.file_path)
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            trunk_line_stops = json.load(f)
+
+        stop_index = get_stop_index(self.stops_path)
+        bad_stops = [
+            f"{trunk}/{service}: {stop_id!r}"
+            for trunk, services in trunk_line_stops.items()
+            for service, stop_ids in services.items()
+            for stop_id in stop_ids
+            if stop_id not in stop_index
+        ]
+        if bad_stops:
+            raise ValueError(f"{self.file_path} has stop ids missing from {self.stops_path}: {', '.join(bad_stops)}")
+
+        service_to_trunk = {}
+        for trunk, services in TRUNK_LINES.items():
+            for service in services:
+                service_to_trunk[service] = trunk
+
+        service_stops = {}
+        stop_services = {}
+        stop_trunks = {}
+        for trunk, services in trunk_line_stops.items():
+            for service, stop_ids in services.items():
+                service_stops[service] = tuple(stop_ids)
+                for stop_id in stop_ids:
+                    stop_services.setdefault(stop_id, [])
+                    if service not in stop_services[stop_id]:
+                        stop_services[stop_id].append(service)
+                    stop_trunks.setdefault(stop_id, set()).add(trunk)
+
+        # Every station's services: the JSON's lists where it has them, else
+        # the service letter its stop id starts with (some lists are still
+        # placeholders)
+        stop_routes = {}
+        for service, stop_ids in stop_index.stops_by_service.items():
+            for stop_id in stop_ids:
+                routes = stop_services.get(stop_id)
+                if routes:
+                    stop_routes[stop_id] = list(routes)
+                elif service in service_to_trunk:
+                    stop_routes[stop_id] = [service]
+
+        self.trunk_line_stops = trunk_line_stops
+        self.service_to_trunk = service_to_trunk
+        self.service_stops = service_stops
+        self.stop_services = stop_services
+        self.stop_trunks = stop_trunks
+        self.stop_routes = stop_routes
+        self.mtime = mtime
+        self.stop_index_version = stop_index.version
+        self.version += 1
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.file_path)
+        except OSError as e:
+            print(f"Error checking {self.file_path}: {e}")
+            return False
+        stop_index_version = get_stop_index(self.stops_path).version
+        if mtime == self.mtime and stop_index_version == self.stop_index_version:
+            return False
+        with self._lock:
+            try:
+                self.load()
+            except (OSError, ValueError) as e:
+                # Keep serving the last good topology
+                print(f"Error reloading {self.file_path}: {e}")
+                return False
+        return True
+
+    def routes_for_stop(self, stop_id):
+        """Services calling at a station, for search results and nearby lists."""
+        return self.stop_routes.get(stop_id) or list(self.stop_services.get(stop_id, ()))
+
+    def trunk_for_service(self, service):
+        return self.service_to_trunk.get(service)
+
+    def stops_for_service(self, trunk_line, service):
+        """Ordered stop ids for a service, if it belongs to trunk_line."""
+        if service not in self.trunk_line_stops.get(trunk_line, {}):
+            return ()
+        return self.service_stops[service]
+
+
+_topology = None
+_topology_lock = threading.Lock()
+
+
+def get_topology():
+    """Shared Topology, loaded on first use and refreshed when its files change."""
+    global _topology
+    if _topology is None:
+        with _topology_lock:
+            if _topology is None:
+                _topology = Topology()
+                return _topology
+    _topology.reload_if_changed()
+    return _topology
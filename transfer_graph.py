@@ -0,0 +1,121 @@
+import csv
+import os
+import threading
+
+from route_catalog import route_bullet
+from stop_index import get_stop_index
+from topology import get_topology
+
+
+def route_icon(topology, stop_id):
+    """Bullet image name for a station's first service, e.g. 'gs' for Times Sq's shuttle platform."""
+    routes = topology.routes_for_stop(stop_id)
+    return route_bullet(routes[0]) if routes else None
+
+
+class TransferGraph:
+    """GTFS transfers.txt as adjacency lists between parent stations.
+
+    Alongside the raw (to_stop_id, min_transfer_time) edges, the transfer
+    list each station page shows is built once at load, with stop names
+    and route icons already resolved.
+    """
+
+    def __init__(self, file_path='transfers.txt', stops_path='stops.txt'):
+        self.file_path = file_path
+        self.stops_path = stops_path
+        self.mtime = None
+        self.stop_index_version = None
+        self.topology_version = None
+        self.version = 0
+        self.adjacency = {}
+        self.station_transfers = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.file_path)
+        stop_index = get_stop_index(self.stops_path)
+        topology = get_topology()
+        adjacency = {}
+        station_transfers = {}
+
+        with open(self.file_path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                from_stop_id = row['from_stop_id']
+                to_stop_id = row['to_stop_id']
+                # Same-station rows only give the time to change platforms
+                if from_stop_id == to_stop_id:
+                    continue
+                from_stop = stop_index.get(from_stop_id)
+                to_stop = stop_index.get(to_stop_id)
+                if from_stop is None or to_stop is None:
+                    print(f"Skipping transfer {from_stop_id} -> {to_stop_id}: stop not in {self.stops_path}")
+                    continue
+                min_transfer_time = int(row.get('min_transfer_time') or 0)
+                adjacency.setdefault(from_stop_id, []).append((to_stop_id, min_transfer_time))
+                station_transfers.setdefault(from_stop_id, []).append({
+                    'from_stop': from_stop.stop_name,
+                    'to_stop': to_stop.stop_name,
+                    'from_route': route_icon(topology, from_stop_id),
+                    'to_route': route_icon(topology, to_stop_id),
+                    'from_stop_id': from_stop_id,
+                    'to_stop_id': to_stop_id,
+                    'min_transfer_time': min_transfer_time
+                })
+
+        self.adjacency = adjacency
+        self.station_transfers = station_transfers
+        self.mtime = mtime
+        self.stop_index_version = stop_index.version
+        self.topology_version = topology.version
+        self.version += 1
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.file_path)
+        except OSError as e:
+            print(f"Error checking {self.file_path}: {e}")
+            return False
+        stop_index_version = get_stop_index(self.stops_path).version
+        topology_version = get_topology().version
+        if (mtime == self.mtime and stop_index_version == self.stop_index_version
+                and topology_version == self.topology_version):
+            return False
+        with self._lock:
+            try:
+                self.load()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error reloading {self.file_path}: {e}")
+                return False
+        return True
+
+    def _station(self, stop_id):
+        stop = get_stop_index(self.stops_path).get(stop_id)
+        if stop is not None and stop.parent_station:
+            return stop.parent_station
+        return stop_id
+
+    def neighbors(self, stop_id):
+        """(to_stop_id, min_transfer_time) for every transfer out of stop_id's station."""
+        return self.adjacency.get(self._station(stop_id), [])
+
+    def transfers_for(self, stop_id):
+        """Transfer dicts for a station page; platform ids use their parent station."""
+        return list(self.station_transfers.get(self._station(stop_id), ()))
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_transfer_graph():
+    """Shared TransferGraph, loaded on first use and refreshed when its files change."""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = TransferGraph()
+                return _graph
+    _graph.reload_if_changed()
+    return _graph
@@ -0,0 +1,71 @@
+import os
+import time
+
+import requests
+
+from metrics import observe_upstream
+from response_cache import response_cache
+from upstream_client import upstream_client
+
+
+TRANSITER_BASE_URL = os.environ.get('TRANSITER_BASE_URL', "https://demo.transiter.dev")
+SYSTEM_URL = f"{TRANSITER_BASE_URL}/systems/us-ny-subway"
+
+# Per-call deadline in seconds for upstream requests
+UPSTREAM_TIMEOUT = upstream_client.timeout[1]
+
+# (ttl, stale_ttl) in seconds per endpoint class. Route metadata barely
+# changes; stop and trip responses carry realtime stopTimes.
+CACHE_POLICIES = {
+    'routes': (3600, 24 * 3600),
+    'stops': (10, 300),
+    'trips': (10, 60),
+}
+DEFAULT_CACHE_POLICY = (10, 60)
+
+
+def clean_stop_id(stop_id):
+    """Strip the /realtime suffix Transiter sometimes appends to stop ids."""
+    if '/realtime' in stop_id:
+        stop_id = stop_id.replace('/realtime', '')
+    return stop_id
+
+
+def endpoint_class(path):
+    """'/stops/127N' -> 'stops', '/routes' -> 'routes'."""
+    return path.strip('/').split('/', 1)[0]
+
+
+def _get(path, timeout):
+    endpoint = endpoint_class(path)
+    started = time.perf_counter()
+    try:
+        response = upstream_client.get(f"{SYSTEM_URL}{path}", timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        observe_upstream(endpoint, type(e).__name__, time.perf_counter() - started)
+        raise
+    observe_upstream(endpoint, 'ok', time.perf_counter() - started)
+    return response.json(), len(response.content)
+
+
+def fetch_json(path, timeout=UPSTREAM_TIMEOUT, fresh=False):
+    """GET a path under the us-ny-subway system and decode the JSON body.
+
+    Responses are cached per CACHE_POLICIES. fresh=True skips cached
+    values (the background poller uses it) but still shares in-flight
+    loads and stores the result. If the upstream call fails (including a
+    fast failure from the open circuit breaker) the last cached response is
+    returned however old it is.
+    """
+    ttl, stale_ttl = CACHE_POLICIES.get(endpoint_class(path), DEFAULT_CACHE_POLICY)
+    loader = lambda: _get(path, timeout)
+    try:
+        if fresh:
+            return response_cache.load(path, loader, ttl, stale_ttl)
+        return response_cache.get(path, loader, ttl, stale_ttl)
+    except requests.exceptions.RequestException:
+        cached = response_cache.peek(path, include_expired=True)
+        if cached is None:
+            raise
+        return cached
@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+
+from metrics import record_timing
+from response_cache import response_cache
+from transiter import fetch_json
+
+
+_trip_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='trip-fetch')
+
+# A trip's stop sequence is re-read this often to pick up its progress; the
+# stops it has already passed are kept from earlier reads
+TRIP_TTL = 120
+TRIP_STALE_TTL = 1800
+
+
+def _station_id(stop_id):
+    return stop_id[:-1] if stop_id[-1:] in ('N', 'S') else stop_id
+
+
+@dataclass
+class TripProgress:
+    """The ordered stops of one trip, as (stop_id, stop_name) pairs.
+
+    Shared by every station the trip passes through, so one fetch answers
+    "what comes after this stop" for all of them.
+    """
+    trip_id: str
+    stops: tuple
+    positions: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.positions = {}
+        for i, (stop_id, _) in enumerate(self.stops):
+            self.positions.setdefault(stop_id, i)
+            self.positions.setdefault(_station_id(stop_id), i)
+
+    @classmethod
+    def from_json(cls, trip_id, data, previous=None):
+        """Parse /trips/<id>/stop_times, keeping stops `previous` had already passed."""
+        stop_times = data if isinstance(data, list) else data.get("stopTimes", [])
+        remaining = tuple(
+            (stop_time["stop"]["id"], stop_time["stop"].get("name"))
+            for stop_time in stop_times if stop_time.get("stop")
+        )
+        if previous is not None and remaining:
+            # Upstream only lists what is left of the trip
+            start = previous.positions.get(remaining[0][0])
+            if start is not None:
+                remaining = previous.stops[:start] + remaining
+        return cls(trip_id=trip_id, stops=remaining)
+
+    def next_stop_after(self, stop_id):
+        """Name of the stop following stop_id (platform or station id), or None."""
+        i = self.positions.get(stop_id)
+        if i is None:
+            i = self.positions.get(_station_id(stop_id))
+        if i is None or i + 1 >= len(self.stops):
+            return None
+        return self.stops[i + 1][1]
+
+
+def fetch_trip_progress(trip_id):
+    """TripProgress for trip_id from the cache, fetching it if needed; None on failure."""
+    key = f"trip-progress:{trip_id}"
+
+    def load():
+        previous = response_cache.peek(key, include_expired=True)
+        progress = TripProgress.from_json(trip_id, fetch_json(f"/trips/{trip_id}/stop_times"), previous)
+        return progress, 64 * len(progress.stops)
+
+    try:
+        return response_cache.get(key, load, TRIP_TTL, TRIP_STALE_TTL)
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Error fetching stop times for trip {trip_id}: {e}")
+        return None
+
+
+def get_trip_progress(trip_ids):
+    """{trip_id: TripProgress or None}, fetching uncached trips concurrently."""
+    trip_ids = list(dict.fromkeys(trip_ids))
+    started = time.perf_counter()
+    progress = dict(zip(trip_ids, _trip_pool.map(fetch_trip_progress, trip_ids)))
+    # Timed here because the pool threads can't add to the request's timings
+    record_timing('upstream', time.perf_counter() - started)
+    return progress
@@ -0,0 +1,112 @@
+"""Record and replay upstream HTTP responses.
+
+TRANSITER_MODE=record appends every upstream response (Transiter JSON and
+GTFS-RT feeds alike) to TRANSITER_ARCHIVE as JSON lines. TRANSITER_MODE=replay
+serves them back from that file instead of the network: each URL answers
+with the last response recorded at or before the virtual clock's time,
+and the clock runs from the start of the recording at REPLAY_SPEED.
+Responses match on path and query, so a recording replays whatever
+TRANSITER_BASE_URL points at. Archives ending in .gz are gzipped.
+"""
+import atexit
+import base64
+import gzip
+import json
+import threading
+import time
+from bisect import bisect_right
+from urllib.parse import urlsplit
+
+import requests
+
+import clock
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _archive_key(url):
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+class RecordingClient:
+    """Wraps an upstream client and appends each response it gets to an archive."""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.timeout = client.timeout
+        self.path = path
+        self._file = _open(path, 'a')
+        self._lock = threading.Lock()
+        # gzip only writes its trailer on close
+        atexit.register(self.close)
+
+    def get(self, url, timeout=None, headers=None):
+        response = self.client.get(url, timeout=timeout, headers=headers)
+        record = {
+            't': time.time(),
+            'url': _archive_key(url),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type'),
+            'body': base64.b64encode(response.content).decode('ascii'),
+        }
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(json.dumps(record) + '\n')
+                self._file.flush()
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayClient:
+    """Serves archived responses in place of the upstream, by virtual time."""
+
+    def __init__(self, path, speed=1.0, timeout=(3.05, 5)):
+        self.timeout = timeout
+        self.responses = {}   # url -> ([recorded times], [records])
+        started = None
+        with _open(path, 'r') as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    times, records = self.responses.setdefault(record['url'], ([], []))
+                    times.append(record['t'])
+                    records.append(record)
+                    started = record['t'] if started is None else min(started, record['t'])
+            except (EOFError, json.JSONDecodeError) as e:
+                # A recording that was killed mid-write; keep what was complete
+                print(f"Archive {path} ends early ({e}); replaying what was read")
+        for times, records in self.responses.values():
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times[:] = [times[i] for i in order]
+            records[:] = [records[i] for i in order]
+        if started is None:
+            raise ValueError(f"{path} has no recorded responses")
+        self.started = started
+        clock.set_virtual(started, speed)
+
+    def get(self, url, timeout=None, headers=None):
+        response = requests.Response()
+        response.url = url
+        entry = self.responses.get(_archive_key(url))
+        if entry is None:
+            response.status_code = 404
+            response._content = b''
+            return response
+        times, records = entry
+        # The newest response recorded by now; before the first, the first
+        record = records[max(0, bisect_right(times, clock.now()) - 1)]
+        response.status_code = record['status']
+        response._content = base64.b64decode(record['body'])
+        if record.get('content_type'):
+            response.headers['Content-Type'] = record['content_type']
+        return response
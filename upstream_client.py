@@ -0,0 +1,180 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from upstream_archive import RecordingClient, ReplayClient
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open every call fails fast. After `reset_timeout` seconds one
+    trial call is let through; success closes the circuit, failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_progress or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self._trial_in_progress = False
+
+
+class RetryBudget:
+    """Allows retries up to `ratio` of recent requests, plus a small floor.
+
+    Keeps retries from multiplying load on an upstream that is already
+    struggling.
+    """
+
+    def __init__(self, ratio=0.2, min_retries_per_second=1, window=10):
+        self.ratio = ratio
+        self.min_retries = min_retries_per_second * window
+        self.window = window
+        self._requests = 0
+        self._retries = 0
+        self._window_start = time.time()
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        if time.time() - self._window_start >= self.window:
+            self._requests = 0
+            self._retries = 0
+            self._window_start = time.time()
+
+    def record_request(self):
+        with self._lock:
+            self._roll()
+            self._requests += 1
+
+    def try_spend(self):
+        with self._lock:
+            self._roll()
+            if self._retries >= self.min_retries + self.ratio * self._requests:
+                return False
+            self._retries += 1
+            return True
+
+
+class UpstreamClient:
+    """One pooled, keep-alive HTTP session for every upstream call.
+
+    GETs use connect/read timeouts, retry connection errors and 5xx/429
+    responses with jittered exponential backoff within a retry budget, and
+    go through a circuit breaker so a dead upstream fails fast. Each host
+    (Transiter, the MTA feeds) gets its own breaker and retry budget, so
+    one failing upstream doesn't cut off the others.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size=32, connect_timeout=3.05, read_timeout=5,
+                 max_retries=2, backoff=0.2):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._hosts = {}   # host -> (CircuitBreaker, RetryBudget)
+        self._hosts_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def guards_for(self, url):
+        """(CircuitBreaker, RetryBudget) for url's host, created on first use."""
+        host = urlsplit(url).netloc
+        guards = self._hosts.get(host)
+        if guards is None:
+            with self._hosts_lock:
+                guards = self._hosts.setdefault(host, (CircuitBreaker(), RetryBudget()))
+        return guards
+
+    def get(self, url, timeout=None, headers=None):
+        """GET url and return the response; raises requests exceptions on failure."""
+        if timeout is None:
+            timeout = self.timeout
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.timeout[0], timeout), timeout)
+
+        breaker, retry_budget = self.guards_for(url)
+        retry_budget.record_request()
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open, not calling {url}")
+            try:
+                response = self.session.get(url, timeout=timeout, headers=headers)
+                if response.status_code in self.RETRY_STATUSES:
+                    response.raise_for_status()
+            except requests.exceptions.RequestException:
+                breaker.record_failure()
+                if attempt >= self.max_retries or not retry_budget.try_spend():
+                    raise
+                attempt += 1
+                # Full jitter so retries from many workers don't line up
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                continue
+            # Other 4xx responses still mean the upstream is healthy
+            breaker.record_success()
+            return response
+
+
+upstream_client = UpstreamClient(
+    pool_size=int(os.environ.get('UPSTREAM_POOL_SIZE', '32')),
+    connect_timeout=float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '3.05')),
+    read_timeout=float(os.environ.get('UPSTREAM_READ_TIMEOUT', '5')),
+    max_retries=int(os.environ.get('UPSTREAM_MAX_RETRIES', '2')),
+)
+
+# live talks to the upstream; record also archives every response;
+# replay serves a recorded archive instead (see upstream_archive)
+TRANSITER_MODE = os.environ.get('TRANSITER_MODE', 'live')
+if TRANSITER_MODE == 'record':
+    upstream_client = RecordingClient(upstream_client, os.environ.get('TRANSITER_ARCHIVE', 'transiter_archive.jsonl.gz'))
+elif TRANSITER_MODE == 'replay':
+    upstream_client = ReplayClient(os.environ.get('TRANSITER_ARCHIVE', 'transiter_archive.jsonl.gz'),
+                                   speed=float(os.environ.get('REPLAY_SPEED', '1')), timeout=upstream_client.timeout)
+elif TRANSITER_MODE != 'live':
+    raise ValueError(f"TRANSITER_MODE must be live, record or replay, not {TRANSITER_MODE!r}")